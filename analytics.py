@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+
+import context
+import personas
+import scenarios  # регистрирует и персоны из SCENARIOS_FILE
+import storage
+from feedback import FEEDBACK_REQUEST
+
+# ====== analytics index config ======
+ANALYTICS_DB = os.getenv("ANALYTICS_DB", "analytics.sqlite3")
+ANALYTICS_BATCH = int(os.getenv("ANALYTICS_BATCH", "5000"))  # строк на одну вставку
+# ====================================
+
+# Cross-session analytics over the chats/ archive. The indexing job streams
+# every transcript into a SQLite table of per-message facts (time, role, length,
+# token estimate, kind, persona); message text stays in the archive. It is
+# incremental: the logs are append-only, so a file that only grew is read from
+# the byte offset where the last run stopped, and only a file that shrank or was
+# rewritten (compaction, legacy JSON) is re-read from the start. Lines are
+# indexed up to the last complete one, so a torn tail is picked up next run.
+#
+# A message gets the persona of its session: the system record opening each
+# session carries it, and in older logs without the field it is recognised by
+# the persona prompt that record holds.
+#
+#   python analytics.py index [--full]
+#   python analytics.py report [--top 10]
+#   python analytics.py sql "SELECT role, avg(tokens) FROM messages GROUP BY role"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    messages INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    ts TEXT,
+    role TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    persona TEXT,
+    chars INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+CREATE VIEW IF NOT EXISTS chats AS
+    SELECT chat_id,
+           count(*) AS messages,
+           sum(role = 'user' AND kind = 'chat') AS turns,
+           sum(kind = 'feedback') AS reports,
+           sum(tokens) AS tokens,
+           min(ts) AS first_ts,
+           max(ts) AS last_ts
+    FROM messages GROUP BY chat_id;
+"""
+
+
+def connect(path: str = ANALYTICS_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _prompts() -> dict:
+    return {p.prompt: p.key for p in personas.all_personas()}
+
+
+def _persona(msg: dict, current: str, prompts: dict) -> str:
+    """Persona of the session `msg` belongs to, given the one of the message before."""
+    if msg.get("persona"):
+        return msg["persona"]
+    if msg.get("role") == "system" and msg.get("content") in prompts:
+        return prompts[msg["content"]]
+    return current
+
+
+def _row(chat_id: int, seq: int, msg: dict, previous_kind: str, persona: str = None) -> tuple:
+    content = msg.get("content") or ""
+    role = msg.get("role", "")
+    if role == "user" and content == FEEDBACK_REQUEST:
+        kind = "feedback_request"
+    elif role == "assistant" and previous_kind == "feedback_request":
+        kind = "feedback"
+    else:
+        kind = "chat"
+    return (
+        chat_id,
+        seq,
+        msg.get("timestamp"),
+        role,
+        kind,
+        persona,
+        len(content),
+        context.count_tokens(content),
+    )
+
+
+def _read_log(path: str, offset: int):
+    """Yields (message, offset after its line) for complete lines from offset on."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return  # хвост ещё дописывается или оборван — доиндексируем позже
+            offset += len(line)
+            try:
+                yield json.loads(line), offset
+            except json.JSONDecodeError:
+                logging.warning(f"Пропущена повреждённая строка в {path}")
+
+
+def _ends_line(path: str, offset: int) -> bool:
+    """Cheap check that the file was appended to rather than rewritten."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset - 1)
+            return f.read(1) == b"\n"
+    except OSError:
+        return False
+
+
+def _read_legacy(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    size = os.path.getsize(path)
+    for msg in data.get("messages", []):
+        yield msg, size
+
+
+def _sources():
+    """(path, chat_id, legacy) for every transcript file in the archive."""
+    if not os.path.isdir(storage.CHATS_DIR):
+        return
+    for entry in os.scandir(storage.CHATS_DIR):
+        name = entry.name
+        if not name.startswith("chat_") or not name.endswith((".json", ".jsonl")):
+            continue
+        try:
+            chat_id = int(name[5:].split(".")[0])
+        except ValueError:
+            continue
+        yield entry, chat_id, name.endswith(".json")
+
+
+def index(conn: sqlite3.Connection, full: bool = False) -> dict:
+    """
+    Brings the index up to date with the archive; returns counters of what was done.
+    With full=True everything is re-read.
+    """
+    if full:
+        conn.execute("DELETE FROM files")
+        conn.execute("DELETE FROM messages")
+    known = {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime, offset, messages FROM files")}
+    stats = {"files": 0, "unchanged": 0, "appended": 0, "reindexed": 0, "messages": 0}
+    prompts = _prompts()
+    batch = []
+
+    def flush_batch():
+        conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        batch.clear()
+
+    for entry, chat_id, legacy in _sources():
+        stats["files"] += 1
+        st = entry.stat()
+        prev = known.get(entry.path)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime:
+            stats["unchanged"] += 1
+            continue
+
+        if prev and not legacy and st.st_size >= prev[2] > 0 and _ends_line(entry.path, prev[2]):
+            # лог только дописывался: читаем с места, где остановились
+            offset, seq = prev[2], prev[3]
+            row = conn.execute(
+                "SELECT kind, persona FROM messages WHERE chat_id = ? AND seq = ?", (chat_id, seq - 1)
+            ).fetchone()
+            kind, persona = row if row else ("chat", None)
+            stats["appended"] += 1
+        else:
+            # новый, переписанный (compact) или старый JSON — целиком
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            offset, seq, kind, persona = 0, 0, "chat", None
+            stats["reindexed" if prev else "appended"] += 1
+
+        start = seq
+        messages = _read_legacy(entry.path) if legacy else _read_log(entry.path, offset)
+        try:
+            for msg, offset in messages:
+                persona = _persona(msg, persona, prompts)
+                row = _row(chat_id, seq, msg, kind, persona)
+                kind = row[4]
+                batch.append(row)
+                seq += 1
+                if len(batch) >= ANALYTICS_BATCH:
+                    flush_batch()
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось проиндексировать {entry.path}: {e}")
+            continue
+        flush_batch()
+        stats["messages"] += seq - start
+        conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (entry.path, chat_id, st.st_size, st.st_mtime, offset, seq),
+        )
+    conn.commit()
+    return stats
+
+
+def report(conn: sqlite3.Connection, top: int = 10):
+    """Prints the standard cross-session summary."""
+    one = lambda sql: conn.execute(sql).fetchone()
+    chats, messages, tokens, first, last = one(
+        "SELECT count(DISTINCT chat_id), count(*), coalesce(sum(tokens), 0), min(ts), max(ts) FROM messages"
+    )
+    if not messages:
+        print("index is empty: run `python analytics.py index` first")
+        return
+    print(f"chats: {chats}  messages: {messages}  tokens (message text): {tokens}")
+    print(f"period: {first} … {last}")
+
+    avg_turns, avg_messages, with_feedback = one(
+        "SELECT avg(turns), avg(messages), sum(reports > 0) FROM chats"
+    )
+    print(f"avg session: {avg_turns:.1f} trainee turns, {avg_messages:.1f} messages; "
+          f"{with_feedback} chats asked for feedback")
+
+    print("\nby role/kind:   n   avg chars   avg tokens")
+    for role, kind, n, chars, toks in conn.execute(
+        "SELECT role, kind, count(*), avg(chars), avg(tokens) FROM messages "
+        "GROUP BY role, kind ORDER BY count(*) DESC"
+    ):
+        print(f"  {role:<11}{kind:<17}{n:>8}{chars:>10.0f}{toks:>10.0f}")
+
+    by_persona = conn.execute(
+        "SELECT persona, count(DISTINCT chat_id), avg(chars) FROM messages "
+        "WHERE persona IS NOT NULL AND role = 'assistant' GROUP BY persona"
+    ).fetchall()
+    if by_persona:
+        print("\nby persona: chats, avg reply chars")
+        for persona, n, chars in by_persona:
+            print(f"  {persona:<30}{n:>6}{chars:>10.0f}")
+
+    print(f"\ntop {top} trainees by tokens: chat_id, turns, tokens, last active")
+    for chat_id, turns, toks, last_ts in conn.execute(
+        "SELECT chat_id, turns, tokens, last_ts FROM chats ORDER BY tokens DESC LIMIT ?", (top,)
+    ):
+        print(f"  {chat_id:<14}{turns:>6}{toks:>10}  {last_ts}")
+
+    print("\nlast 14 days: date, active chats, messages")
+    for day, n_chats, n in conn.execute(
+        "SELECT substr(ts, 1, 10) AS day, count(DISTINCT chat_id), count(*) FROM messages "
+        "WHERE ts IS NOT NULL GROUP BY day ORDER BY day DESC LIMIT 14"
+    ):
+        print(f"  {day}{n_chats:>8}{n:>10}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transcript analytics index")
+    parser.add_argument("--db", default=ANALYTICS_DB)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_index = sub.add_parser("index", help="index new and changed transcripts")
+    p_index.add_argument("--full", action="store_true", help="re-read the whole archive")
+    p_report = sub.add_parser("report", help="print the cross-session summary")
+    p_report.add_argument("--top", type=int, default=10)
+    p_sql = sub.add_parser("sql", help="run a read-only query (tables: messages, files; view: chats)")
+    p_sql.add_argument("query")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = connect(args.db)
+    if args.cmd == "index":
+        t0 = time.perf_counter()
+        stats = index(conn, args.full)
+        print(", ".join(f"{k}: {v}" for k, v in stats.items()) + f" ({time.perf_counter() - t0:.1f} s)")
+    elif args.cmd == "report":
+        report(conn, args.top)
+    else:
+        conn.execute("PRAGMA query_only = ON")
+        cursor = conn.execute(args.query)
+        if cursor.description:
+            print("\t".join(d[0] for d in cursor.description))
+            for row in cursor:
+                print("\t".join("" if v is None else str(v) for v in row))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
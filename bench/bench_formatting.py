@@ -0,0 +1,109 @@
+"""
+Micro-benchmarks of reply formatting: the old ad-hoc passes vs formatting.py.
+
+  headings   bot.py's three uncompiled re.sub scans    vs render(quotes=False)
+  quotes     bot3's split/rejoin asterisk_to_quote    vs render()
+  feedback   asterisk_to_quote + blind 1024-char cuts vs split() at 4096
+  stream     re-rendering the whole buffer per delta  vs Formatter.feed + preview
+
+The new side also escapes for MarkdownV2 and never cuts inside an entity, so
+it does strictly more work per character; the point is that it stays in the
+same range while removing the parse-error resends.
+
+    python bench/bench_formatting.py --repeat 200
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import formatting
+
+
+def old_headings(text: str) -> str:
+    text = re.sub(r"^###\s*(.*)", r"*\1*", text, flags=re.MULTILINE)
+    text = re.sub(r"^##\s*(.*)", r"*\1*", text, flags=re.MULTILINE)
+    text = re.sub(r"^#\s*(.*)", r"*\1*", text, flags=re.MULTILINE)
+    return text
+
+
+def old_quotes(text: str) -> str:
+    new_lines = []
+    for ln in text.splitlines():
+        stripped = ln.strip()
+        if stripped.startswith("*") and stripped.endswith("*") and len(stripped) > 1:
+            new_lines.append(f"> {stripped.strip('*').strip()}")
+        else:
+            new_lines.append(ln)
+    return "\n".join(new_lines)
+
+
+def old_feedback(text: str) -> list:
+    text = old_quotes(text)
+    return [text[i : i + 1024] for i in range(0, len(text), 1024)]
+
+
+def old_stream(deltas: list) -> str:
+    buf, shown = "", ""
+    for delta in deltas:
+        buf += delta
+        shown = old_quotes(buf)
+    return shown
+
+
+def new_stream(deltas: list) -> str:
+    formatter = formatting.Formatter()
+    shown = ""
+    for delta in deltas:
+        formatter.feed(delta)
+        shown = formatter.preview()
+    formatter.finish()
+    return shown
+
+
+REPLY = (
+    "*откидывается на спинку кресла и усмехается*\n"
+    "Вы правда думаете, что это **моя** проблема? Все вокруг (буквально все!) "
+    "просто не способны оценить масштаб того, что я делаю.\n\n"
+    "*пауза*\n"
+    "Ладно... допустим, иногда я бываю резок. Но это 1-2 раза, не больше.\n"
+)
+REPORT = (
+    "### Краткое резюме сессии\n"
+    "Психолог установил *базовый* контакт, но часто уходил в интерпретации.\n\n"
+    "## Сильные стороны\n"
+    "- Отражение чувств: «Похоже, вам важно признание» — удачно.\n"
+    "- Паузы и `валидация` без оценок.\n\n"
+    "## Области для улучшения\n"
+    "1. Конфронтация (слишком рано, на 3-й минуте).\n"
+    "2. Вопросы «почему?» усиливали защиту клиента!\n\n"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    reply = REPLY * 4  # обычный ответ клиента, ~1 КБ
+    report = REPORT * 12  # отчёт супервизора, ~6 КБ
+    deltas = [w + " " for w in (REPLY * 4).split(" ")]  # поток по словам
+
+    cases = [
+        ("headings", lambda: old_headings(report), lambda: formatting.render(report, quotes=False)),
+        ("quotes", lambda: old_quotes(reply), lambda: formatting.render(reply)),
+        ("feedback", lambda: old_feedback(report), lambda: formatting.split(report, quotes=False)),
+        ("stream", lambda: old_stream(deltas), lambda: new_stream(deltas)),
+    ]
+    print(f"{'case':<10}{'old, µs':>10}{'new, µs':>10}")
+    for name, old, new in cases:
+        t_old = min(timeit.repeat(old, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        t_new = min(timeit.repeat(new, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        print(f"{name:<10}{t_old:>10.1f}{t_new:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Throughput benchmark: N trainees talking to the bot at the same time.
+
+Compares the old blocking path (sync OpenAI client called from async handlers,
+so calls run one after another) with llm.chat_completion on the async client.
+
+    python bench/bench_llm.py --users 16 --delay 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+# кэш ответов здесь не используется, но и в chats/ текущего каталога ничего не пишем
+os.environ["RESPONSE_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_llm_")
+
+from openai import OpenAI
+
+from fake_llm import start_server
+
+MESSAGES = [{"role": "user", "content": "Здравствуйте"}]
+
+
+async def blocking_handler(client):
+    # так выглядели обработчики до перехода на AsyncOpenAI
+    client.chat.completions.create(model="deepseek-chat", messages=MESSAGES)
+
+
+async def run(users: int, delay: float):
+    server, base_url = start_server(delay)
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ["LLM_CONCURRENCY"] = str(users)  # и слоты, и размер пула соединений
+    import llm
+
+    # прогрев: импорт/создание клиентов не должны попадать в замер
+    sync_client = OpenAI(api_key="fake", base_url=base_url)
+    await blocking_handler(sync_client)
+    # кэш ответов выключен: одинаковые запросы иначе отдаются с диска
+    await llm.chat_completion(MESSAGES, max_tokens=50, cache=False)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(blocking_handler(sync_client) for _ in range(users)))
+    blocking = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await asyncio.gather(
+        *(llm.chat_completion(MESSAGES, max_tokens=50, cache=False) for _ in range(users))
+    )
+    non_blocking = time.perf_counter() - t0
+
+    server.shutdown()
+    print(f"users={users} delay={delay}s")
+    print(f"  blocking (sync client):  {blocking:6.2f} s  {users / blocking:6.1f} req/s")
+    print(f"  llm.chat_completion:     {non_blocking:6.2f} s  {users / non_blocking:6.1f} req/s")
+    print(f"  speed-up: x{blocking / non_blocking:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.delay))
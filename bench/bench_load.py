@@ -0,0 +1,220 @@
+"""
+Offline load test of bot3: hundreds of trainees going through whole sessions.
+
+Each simulated trainee sends /start, gives consent, has a conversation of a
+realistic (log-normal) number of turns with think time between them, and may
+ask for feedback or clear the memory along the way. Updates go through bot3's
+real `chat`/`command` handlers and the per-chat dispatcher; Telegram is replaced
+by fake_telegram and DeepSeek by the local fake LLM (latency, streaming and
+error rate are configurable).
+
+Reported: throughput, latency percentiles per action, errors shown to trainees,
+resident memory per session and bytes left on disk (transcripts + session DB).
+
+    python bench/bench_load.py --users 300 --turns 12 --streaming --error-rate 0.02
+
+With many users, chat latency is dominated by waiting for one of the
+LLM_CONCURRENCY slots; --llm-concurrency shows how much a larger pool buys.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+from fake_llm import start_server
+from fake_telegram import FakeContext, FakeUpdate
+
+CONSENT = "✅ Я соглашаюсь"
+CLEAR = "🧹 Очистить память"
+FEEDBACK = "📝 Обратная связь"
+PHRASES = [
+    "Расскажите, что привело вас сегодня?",
+    "Как вы себя чувствовали, когда это произошло?",
+    "Похоже, для вас очень важно, чтобы это заметили.",
+    "Что вы имеете в виду, когда говорите, что вас не ценят?",
+    "Давайте попробуем посмотреть на это с другой стороны.",
+]
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), falling back to the peak RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def disk_bytes(root: str) -> int:
+    total = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+
+class Trainee:
+    """One closed-loop user: sends the next update once the previous turn finished."""
+
+    def __init__(self, bot3, chat_id: int, done: dict, stats: dict, args):
+        self.bot3 = bot3
+        self.chat_id = chat_id
+        self.done = done
+        self.stats = stats
+        self.args = args
+        self.ctx = FakeContext()
+
+    async def send(self, text: str):
+        update = FakeUpdate(self.chat_id, text, on_reply=self.on_reply)
+        event = self.done[self.chat_id] = asyncio.Event()
+        t0 = time.perf_counter()
+        if text.startswith("/"):
+            await self.bot3.command(update, self.ctx)
+        else:
+            await self.bot3.chat(update, self.ctx)
+        await event.wait()
+        action = self.bot3.ACTIONS.get(text, "chat")
+        self.stats.setdefault(action, []).append(time.perf_counter() - t0)
+
+    def on_reply(self, chat_id, text):
+        if text.startswith("⚠️"):
+            self.stats["errors"] += 1
+
+    async def think(self):
+        if self.args.think:
+            await asyncio.sleep(random.expovariate(1 / self.args.think))
+
+    async def session(self):
+        await self.send("/start")
+        await self.send(CONSENT)
+        # длина учебной сессии: логнормальная с медианой --turns, от 3 до 5×медианы
+        turns = int(random.lognormvariate(math.log(self.args.turns), 0.5))
+        for _ in range(max(3, min(turns, 5 * self.args.turns))):
+            await self.think()
+            await self.send(random.choice(PHRASES))
+            if random.random() < self.args.clear_rate:
+                await self.send(CLEAR)
+        if random.random() < self.args.feedback_rate:
+            await self.send(FEEDBACK)
+
+
+async def run(args, workdir: str):
+    import bot3
+    import persist
+
+    done = {}
+    stats = {"errors": 0}
+
+    # ход закончен, когда обработчик диспетчера вернулся: так меряется вся
+    # обработка апдейта, включая ожидание в очереди чата
+    turn = bot3.dispatcher.handler
+
+    async def traced(update, ctx, text):
+        try:
+            await turn(update, ctx, text)
+        finally:
+            done[update.message.chat_id].set()
+
+    bot3.dispatcher.handler = traced
+    persist.writer.start()
+
+    # прогрев: импорты (openai грузится лениво), пул соединений, первые аллокации
+    await bot3.llm.warm()
+    await Trainee(bot3, 10**9, done, {"errors": 0}, args).send(CONSENT)
+    disk0, rss0 = disk_bytes(workdir), rss_bytes()
+
+    trainees = [Trainee(bot3, chat_id, done, stats, args) for chat_id in range(1, args.users + 1)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(t.session() for t in trainees))
+    elapsed = time.perf_counter() - t0
+
+    rss1 = rss_bytes()
+    await bot3.dispatcher.join()
+    await persist.writer.stop()
+    bot3.user_histories.close()
+    disk1 = disk_bytes(workdir)
+
+    updates = sum(len(v) for k, v in stats.items() if k != "errors")
+    print(f"  {updates} updates in {elapsed:.1f}s: {updates / elapsed:.1f} updates/s, errors shown: {stats['errors']}")
+    print(f"  {'action':<10}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for action in ("start", "consent", "chat", "clear", "feedback"):
+        values = stats.get(action)
+        if values:
+            row = "".join(f"{percentile(values, q):9.3f}" for q in (0.5, 0.95, 0.99, 1.0))
+            print(f"  {action:<10}{len(values):>7}{row}")
+    print(f"  memory per session: {(rss1 - rss0) / args.users / 1024:.1f} KiB (RSS growth / users)")
+    print(f"  disk: {(disk1 - disk0) / 1024:.0f} KiB total, {(disk1 - disk0) / updates:.0f} B per update")
+    print(f"  llm requests: {bot3.llm.usage_stats['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=12, help="median turns per session")
+    parser.add_argument("--think", type=float, default=0.5, help="mean think time between turns, s")
+    parser.add_argument("--feedback-rate", type=float, default=0.3, help="share of sessions ending with feedback")
+    parser.add_argument("--clear-rate", type=float, default=0.01, help="chance to clear memory after a turn")
+    parser.add_argument("--delay", type=float, default=0.3, help="fake LLM latency (to first token), s")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="delay between streamed words, s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM requests failed with 429/500")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--sessions", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--llm-concurrency", type=int, help="override LLM_CONCURRENCY (slots and pool size)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    server, llm_url = start_server(
+        args.delay, processes=4, chunk_delay=args.chunk_delay, error_rate=args.error_rate
+    )
+    workdir = tempfile.mkdtemp()
+    # конфиг читается при импорте bot3, поэтому окружение задаётся до него
+    os.environ.update(
+        TELEGRAM_TOKEN="123:fake",
+        DEEPSEEK_API_KEY="fake",
+        DEEPSEEK_BASE_URL=llm_url,
+        CHATS_DIR=os.path.join(workdir, "chats"),
+        SESSIONS_BACKEND=args.sessions,
+        SESSIONS_DB=os.path.join(workdir, "sessions.sqlite3"),
+        STREAMING="1" if args.streaming else "0",
+        STREAM_EDIT_INTERVAL="0.2",
+        COALESCE_DEBOUNCE="0",
+        LLM_RPM="1e9",
+        LLM_TPM="1e12",
+        RETRY_BASE_DELAY="0.05",
+    )
+    if args.llm_concurrency:
+        os.environ["LLM_CONCURRENCY"] = str(args.llm_concurrency)
+    import logging
+
+    logging.basicConfig(level=logging.ERROR)
+    print(
+        f"users={args.users} turns~{args.turns} think={args.think}s delay={args.delay}s "
+        f"streaming={args.streaming} error_rate={args.error_rate} sessions={args.sessions}"
+    )
+    asyncio.run(run(args, workdir))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
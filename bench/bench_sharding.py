@@ -0,0 +1,124 @@
+"""
+Messages/sec scaling of the sharded mode from 1 to N worker processes.
+
+A fake Telegram update source plays closed-loop trainees (each sends its next
+message once the previous reply arrived) and routes raw updates with
+sharding.HashRing, exactly like the front process does. Workers are the real
+sharding.worker_main: bot3's Application without an updater, fed through its
+update queue, with the Bot API replaced by FakeBotRequest and DeepSeek by the
+local fake LLM.
+
+Scaling needs spare cores: every worker is a separate process, so on a machine
+with fewer cores than workers (plus the fake LLM) the numbers stay flat or drop.
+
+    python bench/bench_sharding.py --max-workers 4 --users 200 --turns 5
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import sharding
+from fake_llm import start_server
+from fake_telegram import update_dict
+
+CONSENT = "✅ Я соглашаюсь"
+
+
+def build_fake_application(results, updater: bool = True):
+    """Build target for worker_main: bot3's Application talking to FakeBotRequest."""
+    import logging
+
+    import bot3
+    from fake_telegram import FakeBotRequest
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # по одному сигналу на каждый ответ бота (sendMessage)
+    on_send = lambda chat_id, endpoint: endpoint == "sendMessage" and results.put(chat_id)
+    return bot3.build_application(request=FakeBotRequest(on_send), updater=updater)
+
+
+def measure(workers: int, users: int, turns: int) -> float:
+    results = mp.get_context("spawn").Queue()
+    queues, procs = sharding.start_workers(
+        workers, sharding.worker_main, ("bench_sharding:build_fake_application", results)
+    )
+    ring = sharding.HashRing(range(workers))
+    left = {chat_id: turns for chat_id in range(1, users + 1)}
+    update_id = 0
+
+    def send(chat_id, text):
+        nonlocal update_id
+        update_id += 1
+        queues[ring.node(chat_id)].put(update_dict(update_id, chat_id, text))
+
+    # прогрев: по одному чату на воркер, чтобы импорты и запуск не попали в замер
+    warm = {}
+    for chat_id in range(10**6, 10**6 + 50 * workers):
+        warm.setdefault(ring.node(chat_id), chat_id)
+    for chat_id in warm.values():
+        send(chat_id, CONSENT)
+    for _ in warm:
+        results.get()
+
+    t0 = time.perf_counter()
+    for chat_id in left:
+        send(chat_id, CONSENT)
+    done, total = 0, users * (turns + 1)
+    while done < total:
+        chat_id = results.get()
+        done += 1
+        if left[chat_id]:
+            left[chat_id] -= 1
+            send(chat_id, f"Сообщение {left[chat_id]}")
+    elapsed = time.perf_counter() - t0
+
+    sharding.stop_workers(queues, procs)
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.05, help="fake LLM latency, s")
+    parser.add_argument("--llm-processes", type=int, default=4, help="processes serving the fake LLM")
+    args = parser.parse_args()
+
+    server, llm_url = start_server(args.delay, processes=args.llm_processes)
+    chats_dir = tempfile.mkdtemp()
+    # воркеры наследуют окружение; лимиты подняты, чтобы мерить бота, а не лимитер
+    os.environ.update(
+        TELEGRAM_TOKEN="123:fake",
+        DEEPSEEK_API_KEY="fake",
+        DEEPSEEK_BASE_URL=llm_url,
+        CHATS_DIR=chats_dir,
+        SESSIONS_BACKEND="memory",
+        COALESCE_DEBOUNCE="0",
+        LLM_RPM="1e9",
+        LLM_TPM="1e12",
+        TG_GLOBAL_PER_SEC="1e6",
+        TG_PRIVATE_PER_SEC="1e6",
+    )
+
+    cores = os.cpu_count()
+    print(f"users={args.users} turns={args.turns} llm_delay={args.delay}s cores={cores}")
+    if cores < args.max_workers + 1:
+        print(f"  note: {cores} core(s) for up to {args.max_workers} workers + fake LLM — expect no scaling")
+    base = None
+    for workers in range(1, args.max_workers + 1):
+        rate = measure(workers, args.users, args.turns)
+        base = base or rate
+        print(f"  workers={workers}: {rate:7.1f} msg/s  (x{rate / base:.2f})")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
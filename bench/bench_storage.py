@@ -0,0 +1,65 @@
+"""
+Append cost as a session grows: old read-modify-write JSON vs storage.py JSONL log.
+
+    python bench/bench_storage.py --messages 3000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+TEXT = "Я не бездельник — просто жду идеальных условий. " * 4
+
+
+def legacy_save(filename: str, chat_id: int, role: str, content: str):
+    # прежняя реализация save_message_to_json
+    message_data = {"role": role, "content": content, "timestamp": datetime.now().isoformat()}
+    if os.path.exists(filename):
+        with open(filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = {"chat_id": chat_id, "messages": []}
+    data["messages"].append(message_data)
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def measure(save, n: int, step: int):
+    """Returns [(messages so far, mean µs per append over the last step)]."""
+    points, t0 = [], time.perf_counter()
+    for i in range(1, n + 1):
+        save(i)
+        if i % step == 0:
+            points.append((i, (time.perf_counter() - t0) / step * 1e6))
+            t0 = time.perf_counter()
+    return points
+
+
+def main(n: int, step: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.CHATS_DIR = tmp
+        legacy_file = os.path.join(tmp, "legacy.json")
+        old = measure(lambda i: legacy_save(legacy_file, 1, "user", TEXT), n, step)
+        new = measure(lambda i: storage.append_message(2, "user", TEXT), n, step)
+        storage.close_all()
+
+        print(f"{'messages':>9} {'json µs/msg':>12} {'jsonl µs/msg':>13}")
+        for (i, a), (_, b) in zip(old, new):
+            print(f"{i:>9} {a:>12.0f} {b:>13.0f}")
+        print(f"total bytes: json={os.path.getsize(legacy_file)} "
+              f"jsonl={os.path.getsize(storage.log_path(2))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--step", type=int, default=500)
+    args = parser.parse_args()
+    main(args.messages, args.step)
@@ -0,0 +1,144 @@
+"""
+Local OpenAI-compatible stand-in for DeepSeek used by the benchmarks.
+Answers POST /chat/completions after an artificial delay, so that the bot's
+concurrency behaviour can be measured without network access or API keys.
+Streaming requests get server-sent events one word at a time, and a share of
+requests can be failed with 429/500 to exercise the retry path.
+"""
+import json
+import multiprocessing as mp
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # иначе при сотнях одновременных клиентов часть соединений ждёт повторного SYN
+
+
+class _Handler(BaseHTTPRequestHandler):
+    delay = 0.5  # секунд на один ответ (в потоке — до первого слова)
+    chunk_delay = 0.0  # секунд между словами потока
+    error_rate = 0.0  # доля запросов, на которые отвечаем 429/500
+    reply = "Ну... не знаю, что вам на это ответить."
+    usage = {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+
+    def do_GET(self):
+        # GET /models: им прогревается пул соединений при старте бота (llm.warm)
+        self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model", "owned_by": "fake"}]})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            status = random.choice((429, 500))
+            self._send_json(status, {"error": {"message": "fake failure", "type": "server_error"}})
+            return
+        if body.get("stream"):
+            self._stream(body)
+            return
+
+        payload = {
+            "id": "fake-1",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "deepseek-chat"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self.usage,
+        }
+        self._send_json(200, payload)
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, body: dict):
+        # HTTP/1.0: конец потока обозначается закрытием соединения
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def event(delta, finish=None, usage=None):
+            chunk = {
+                "id": "fake-1",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "deepseek-chat"),
+                "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if usage:
+                chunk["usage"] = usage
+            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            event({"content": word if i == 0 else " " + word})
+        event({}, finish="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event(None, usage=self.usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve_forked(server):
+    server.serve_forever()
+
+
+class _ServerGroup:
+    """Several forked processes accepting on one listening socket."""
+
+    def __init__(self, server, processes: int):
+        ctx = mp.get_context("fork")
+        self.procs = [ctx.Process(target=_serve_forked, args=(server,), daemon=True) for _ in range(processes)]
+        for p in self.procs:
+            p.start()
+        self.server = server
+
+    def shutdown(self):
+        for p in self.procs:
+            p.terminate()
+        self.server.server_close()
+
+
+def start_server(
+    delay: float = 0.5,
+    port: int = 0,
+    processes: int = 1,
+    chunk_delay: float = 0.0,
+    error_rate: float = 0.0,
+    reply: str = None,
+):
+    """
+    Starts the fake server; returns (server, base_url). With processes > 1 the
+    socket is served by forked processes, so the fake LLM itself is not the
+    bottleneck of multi-process benchmarks.
+    """
+    attrs = {"delay": delay, "chunk_delay": chunk_delay, "error_rate": error_rate}
+    if reply:
+        attrs["reply"] = reply
+    handler = type("Handler", (_Handler,), attrs)
+    server = _Server(("127.0.0.1", port), handler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    if processes > 1:
+        return _ServerGroup(server, processes), base_url
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
@@ -0,0 +1,134 @@
+"""
+Minimal stand-ins for the parts of python-telegram-bot the handlers touch:
+update.message.{chat_id,text,reply_text,edit_text,get_bot}, ctx.bot.send_chat_action
+and ctx.chat_data.
+Every outgoing message is recorded, and on_reply(chat_id, text) fires per reply.
+FakeBotRequest goes one level lower and lets a real Application run offline.
+"""
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+_ids = itertools.count(1)
+
+
+class FakeBot:
+    def __init__(self):
+        self.actions = 0
+
+    async def send_chat_action(self, chat_id, action):
+        self.actions += 1
+
+
+class FakeMessageBot:
+    # то, что streaming вызывает у ExtBot, когда передаёт rate_limit_args
+    def __init__(self, message):
+        self.message = message
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self.message.reply_text(text, **kwargs)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self.message.edit_text(text, **kwargs)
+
+
+class FakeMessage:
+    message_thread_id = None
+    is_topic_message = False
+
+    def __init__(self, chat_id: int, text: str, on_reply=None):
+        self.message_id = next(_ids)
+        self.chat_id = chat_id
+        self.text = text
+        self.on_reply = on_reply
+        self.replies = []
+        self.edits = 0
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None, **kwargs):
+        sent = FakeMessage(self.chat_id, text)
+        self.replies.append(sent)
+        if self.on_reply is not None:
+            self.on_reply(self.chat_id, text)
+        return sent
+
+    async def edit_text(self, text, parse_mode=None, **kwargs):
+        self.text = text
+        self.edits += 1
+        return self
+
+    def get_bot(self):
+        return FakeMessageBot(self)
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, text: str, on_reply=None):
+        self.message = FakeMessage(chat_id, text, on_reply)
+        self.effective_chat = FakeChat(chat_id)
+        self.effective_user = FakeChat(chat_id)
+
+
+class FakeContext:
+    def __init__(self, bot: FakeBot = None):
+        self.bot = bot or FakeBot()
+        self.chat_data = {}
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    Bot API transport for a real telegram.Bot/Application that never leaves the
+    process: every endpoint answers "ok", sendMessage/editMessageText return a
+    plausible Message, and on_send(chat_id, endpoint) fires for each of them.
+    """
+
+    def __init__(self, on_send=None):
+        self.on_send = on_send
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if self.on_send is not None:
+                self.on_send(chat_id, endpoint)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def update_dict(update_id: int, chat_id: int, text: str) -> dict:
+    """Raw Bot API update for a private text message, as the front process forwards it."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Trainee"},
+            "text": text,
+        },
+    }
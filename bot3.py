@@ -1,9 +1,11 @@
 import os
-import json
+import asyncio
 import logging
-import re
-from datetime import datetime
 from dotenv import load_dotenv
+
+# 1) загружаем переменные окружения — до импорта модулей бота, они читают конфиг при импорте
+load_dotenv()
+import startup  # первым из модулей бота: от него отсчитывается время холодного старта
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -12,124 +14,108 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-from openai import OpenAI
 
-# 1) загружаем переменные окружения
-load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 
-# 2) настраиваем "клиента" DeepSeek
-client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url="https://api.deepseek.com",
-)
+# 2) настраиваем "клиента" DeepSeek (асинхронный, с лимитом параллельных запросов)
+import llm
+import storage
+import persist
+import summarizer
+import compactor
+import prompt
+import streaming
+import personas
+import scenarios
+import sessions
+import feedback
+import ratelimit
+import metrics
+import webhook
+import sharding
+from dispatcher import ChatDispatcher
+from telegram_limits import TelegramRateLimiter
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
+startup.mark("imports")  # openai сюда не входит: он грузится при прогреве (llm.warm)
 
 # ====== dialogue‑window & summary config ======
-MAX_WINDOW = 6  # how many last messages keep uncompressed
-SUMMARY_MAXTOK = 120  # token budget for DeepSeek when updating summary
+# размер окна задаётся бюджетом токенов CONTEXT_BUDGET (см. context.py)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))  # parallel handlers
 # =============================================
 
 # Создаем папку для хранения чатов
-os.makedirs("chats", exist_ok=True)
+os.makedirs(storage.CHATS_DIR, exist_ok=True)
 
-# Глобальное хранилище истории диалогов
-user_histories = {}
+# Хранилище сессий: SQLite + LRU в памяти, сессии подгружаются лениво
+# при первом сообщении после рестарта (см. sessions.py)
+user_histories = sessions.make_store()
 
 
-# Создаем клавиатуру для меню
-def get_reply_keyboard():
-    return ReplyKeyboardMarkup(
-        [["🧹 Очистить память", "📝 Обратная связь"]],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-    )
+# Сценарий чата (персона, окно, summary, модель) — общий неизменяемый объект
+# из scenarios.py; сессия ссылается на него и на персону по id, а не хранит копии.
+# Выбранный в /start сценарий до согласия хранится в ctx.chat_data
+def chosen_scenario(ctx) -> scenarios.Scenario:
+    return scenarios.select(ctx.chat_data.get("scenario"))
 
 
-# Функция для сохранения сообщения в JSON
-def save_message_to_json(chat_id: int, role: str, content: str):
-    try:
-        filename = f"chats/chat_{chat_id}.json"
-        message_data = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-        }
-
-        # Создаем или загружаем существующий файл
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            data = {"chat_id": chat_id, "messages": []}
+# Создаем клавиатуру для меню (одна на сценарий)
+_keyboards = {}
 
-        # Добавляем новое сообщение
-        data["messages"].append(message_data)
 
-        # Сохраняем обновленные данные
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+def get_reply_keyboard(scenario: scenarios.Scenario = None):
+    scenario = scenario or scenarios.default()
+    keyboard = _keyboards.get(scenario.id)
+    if keyboard is None:
+        buttons = ["🧹 Очистить память"] + (["📝 Обратная связь"] if scenario.feedback else [])
+        keyboard = _keyboards[scenario.id] = ReplyKeyboardMarkup(
+            [buttons], resize_keyboard=True, one_time_keyboard=False
+        )
+    return keyboard
+
 
+# Функция для сохранения сообщения: ставим в очередь write-behind (см. persist.py),
+# запись на диск идёт в фоне и не задерживает ответ
+def save_message_to_json(chat_id: int, role: str, content: str, persona: str = None):
+    try:
+        persist.writer.enqueue(chat_id, role, content, persona)
     except Exception as e:
         logging.error(f"Ошибка при сохранении сообщения: {e}")
 
 
-# Функция для загрузки истории из JSON
+# Функция для загрузки истории (старый chat_{id}.json переносится автоматически)
 def load_chat_history(chat_id: int) -> dict:
-    filename = f"chats/chat_{chat_id}.json"
-    if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"chat_id": chat_id, "messages": []}
-
-
-# --- formatting helpers --------------------------------------------------
-def asterisk_to_quote(text: str) -> str:
-    """
-    Converts lines that are fully wrapped in *asterisks* to block‑quotes for Telegram.
-    Example: '*Hello*'  -> '> Hello'
-    Only treats a line as a quote if the asterisks enclose the entire trimmed line.
-    """
-    new_lines = []
-    for ln in text.splitlines():
-        stripped = ln.strip()
-        if stripped.startswith("*") and stripped.endswith("*") and len(stripped) > 1:
-            content = stripped.strip("*").strip()
-            new_lines.append(f"> {content}")
-        else:
-            new_lines.append(ln)
-    return "\n".join(new_lines)
+    return storage.load_chat_history(chat_id)
 
 
-# -------------------------------------------------------------------------
+# Разметка ответов (MarkdownV2, цитаты, разбиение по 4096) — formatting.py,
+# отправка — streaming.send_reply / stream_reply
 
 
-# 3) /start с описанием бота и согласием
-async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+# 3) /start [сценарий]: описание бота и согласие, либо сразу приветствие
+async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE, payload: str = ""):
     chat_id = update.message.chat_id
+    session = await user_histories.get(chat_id)
+    if payload:
+        ctx.chat_data["scenario"] = payload  # deep link t.me/<bot>?start=<сценарий>
+    elif session is not None and "scenario" not in ctx.chat_data:
+        ctx.chat_data["scenario"] = scenarios.of(session).id
+    scenario = chosen_scenario(ctx)
+
+    if not scenario.consent:
+        # сценарий без согласия: сессия начинается сразу (или продолжается)
+        if session is None or scenarios.of(session) is not scenario:
+            await start_session(chat_id, scenario)
+        await update.message.reply_text(
+            personas.get(scenario.persona_key).greeting,
+            reply_markup=get_reply_keyboard(scenario),
+        )
+        return
 
-    # Отправляем описание бота и запрос согласия
-    bot_description = (
-        "👋 *Добро пожаловать в симулятор для отработки навыков психолога!*\n\n"
-        "🤖 *Назначение бота:*\n"
-        "Этот бот имитирует поведение клиента с симптомами нарциссизма. "
-        "Он предназначен исключительно для учебных целей - отработки терапевтических навыков, "
-        "техник активного слушания и стратегий работы с депрессивными состояниями.\n\n"
-        "🔒 *Конфиденциальность и согласие:*\n"
-        "1. Весь диалог сохраняется в анонимизированном виде для анализа учебного процесса\n"
-        "2. Ваши сообщения используются исключительно для генерации ответов бота\n"
-        "3. Для продолжения работы необходимо согласие на обработку учебных данных\n\n"
-        "📄 Полный текст политики конфиденциальности доступен по [ссылке](https://disk.yandex.ru/d/Ow77Ht28TDstzg)\n\n"
-        '✅ *Нажимая кнопку "Я соглашаюсь" ниже, вы подтверждаете:*\n'
-        "- Понимание учебной природы бота\n"
-        "- Согласие на сохранение анонимизированной истории диалога\n"
-        "- Отсутствие ожидания реальной психологической помощи\n"
-        "- Использование исключительно в учебных целях"
-    )
+    # Отправляем описание сценария и запрос согласия
+    bot_description = scenario.welcome
 
     # Создаем клавиатуру для согласия
     consent_keyboard = ReplyKeyboardMarkup(
@@ -141,64 +127,33 @@ async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Новая сессия выбранного сценария; system-промпт персоны — первая запись лога
+async def start_session(chat_id: int, scenario: scenarios.Scenario) -> dict:
+    summarizer.cancel(chat_id)
+    compactor.discard(chat_id)
+    session = scenario.new_session()
+    await user_histories.put(chat_id, session)
+    metrics.sessions_started.inc(scenario=scenario.id, tenant=scenario.tenant)
+    if scenario.transcript:
+        save_message_to_json(chat_id, "system", personas.get(session["persona"]).prompt, session["persona"])
+    return session
+
+
 # Обработчик согласия
 async def consent(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
-    user_histories[chat_id] = {
-        "system": """Ты — клиент (23 года) на первой сессии у психолога. Дефицитарный нарцисс. Запрос: "Помогите преодолеть прокрастинацию и стать эффективнее".
-
-Ключевые правила поведения:
-
-1. Образование:
-   * Нет психологического образования. На вопросы с терминами отвечай как обычный человек ("Дихотомия…ну читал где-то, но подзабыл, что это").
-
-2. Динамика сессии:
-   * Сопротивляйся раскрытию уязвимости ("Я не вижу смысла говорить о неудачах").
-   * Меняй поведение *медленно* только при экологичном воздействии психолога. При этом периодически откатывайся к прежним установкам и поведению.
-
-3. Стиль общения:
-   * Свободная речь (без жаргонов), но с интеллигентностью ("Я не бездельник — просто жду идеальных условий").
-
-Характеристики личности:
-
-* Прошлое: Родители-перфекционисты, любовь — только за достижения. Чувство условной ценности.
-
-* Эмоции: Стыд при ошибках, зависть к успешным, страх неудачи парализует ценностные действия.
-
-* Когнитивные искажения:
-   * Дихотомия: "Не идеально = провал"
-   * Сверхобобщение: "Одна ошибка = я ничтожество"
-   * Долженствование: "Должен быть безупречным"
-
-* Защитные механизмы и копинг стратегии:
-   * Идеализация себя ("Я гениален в потенциале") → обесценивание других ("Психолог не понимает моих амбиций"). И наоборот, идеализация других и обесценивание себя
-   * Избегание ситуаций потенциальной неидеальности.
-
-Триггеры сопротивления:
-* вопросы о чувствах 
-* предложения о рефлексии 
-* критика стратегии идеализации. Не показывай свой внутренний монолог - я не умею читать мысли и могу лишь слышать твои слова и видеть твои движения. Не интерпретируй их за меня.""",
-        "history": [],
-        "summary": "",
-    }
-
-    # Сохраняем системное сообщение
-    save_message_to_json(chat_id, "system", user_histories[chat_id]["system"])
+    scenario = chosen_scenario(ctx)
+    session = await start_session(chat_id, scenario)
 
     # Приветствие после согласия
     await update.message.reply_text(
-        "Наконец-то! Честно говоря, я удивлен, что согласился прийти к вам.\n\n"
-        "Привет... Знаете, я обычно не хожу к психологам - я довольно умный человек "
-        "и привык справляться со всем сам. Но сейчас... не знаю, что со мной происходит. "
-        "Я же всегда был успешным, все получалось легко, а теперь... "
-        "Надеюсь, вы достаточно квалифицированы, чтобы понять мою ситуацию. "
-        "Она довольно сложная и необычная.",
-        reply_markup=get_reply_keyboard(),
+        personas.get(session["persona"]).greeting,
+        reply_markup=get_reply_keyboard(scenario),
     )
 
 
 # 4) Функция для обобщения истории
-def summarize_messages(messages: list) -> str:
+async def summarize_messages(messages: list) -> str:
     """Обобщает историю сообщений через DeepSeek"""
     try:
         # Форматируем историю в текст
@@ -215,8 +170,7 @@ def summarize_messages(messages: list) -> str:
         )
 
         # Делаем запрос к DeepSeek
-        response = client.chat.completions.create(
-            model="deepseek-chat",
+        response = await llm.chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -233,169 +187,137 @@ def summarize_messages(messages: list) -> str:
         return "Не удалось обобщить историю"
 
 
-def update_summary(existing_summary: str, msg: dict) -> str:
-    """
-    Incrementally updates the short dialogue summary with the newest message.
-    Only truly important info should be added; otherwise the summary is returned unchanged.
-    """
-    try:
-        prompt = (
-            "У тебя есть краткое обобщение диалога (может быть пустым). "
-            "Ниже приведено сообщение, которое скоро будет удалено из активного контекста. "
-            "Добавь в обобщение ТОЛЬКО значимую информацию, если она есть. "
-            "Если важной информации нет — верни обобщение без изменений. "
-            "Верни ТОЛЬКО итоговое обобщение, без пояснений.\n\n"
-            f"Текущее обобщение:\n{existing_summary or '—'}\n\n"
-            f"Новое сообщение:\n{msg['role']}: {msg['content']}"
-        )
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Ты — помощник, редактирующий краткое обобщение диалога.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=SUMMARY_MAXTOK,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logging.error(f"Ошибка при обновлении summary: {e}")
-        return existing_summary
-
-
-# 5) Обработчик очистки истории
+# 5) Обработчик очистки истории: новая сессия того же сценария
 async def clear_history(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
-    user_histories[chat_id] = {
-        "system": """Ты — клиент (23 года) на первой сессии у психолога. Дефицитарный нарцисс. Запрос: "Помогите преодолеть прокрастинацию и стать эффективнее".
-
-Ключевые правила поведения:
-
-1. Образование:
-   * Нет психологического образования. На вопросы с терминами отвечай как обычный человек ("Дихотомия…ну читал где-то, но подзабыл, что это").
-
-2. Динамика сессии:
-   * Сопротивляйся раскрытию уязвимости ("Я не вижу смысла говорить о неудачах").
-   * Меняй поведение *медленно* только при экологичном воздействии психолога. При этом периодически откатывайся к прежним установкам и поведению.
-
-3. Стиль общения:
-   * Свободная речь (без жаргонов), но с интеллигентностью ("Я не бездельник — просто жду идеальных условий").
-
-Характеристики личности:
-
-* Прошлое: Родители-перфекционисты, любовь — только за достижения. Чувство условной ценности.
-
-* Эмоции: Стыд при ошибках, зависть к успешным, страх неудачи парализует ценностные действия.
-
-* Когнитивные искажения:
-   * Дихотомия: "Не идеально = провал"
-   * Сверхобобщение: "Одна ошибка = я ничтожество"
-   * Долженствование: "Должен быть безупречным"
-
-* Защитные механизмы и копинг стратегии:
-   * Идеализация себя ("Я гениален в потенциале") → обесценивание других ("Психолог не понимает моих амбиций"). И наоборот, идеализация других и обесценивание себя
-   * Избегание ситуаций потенциальной неидеальности.
-
-Триггеры сопротивления:
-* вопросы о чувствах 
-* предложения о рефлексии 
-* критика стратегии идеализации. Не показывай свой внутренний монолог - я не умею читать мысли и могу лишь слышать твои слова и видеть твои движения. Не интерпретируй их за меня.""",
-        "history": [],
-        "summary": "",
-    }
+    # фоновая работа по старой сессии (свёртка summary, заготовленный промпт) — в корзину
+    summarizer.cancel(chat_id)
+    compactor.discard(chat_id)
+    session = await user_histories.get(chat_id)
+    scenario = scenarios.of(session) if session is not None else chosen_scenario(ctx)
+    session = scenario.new_session()
+    await user_histories.put(chat_id, session)
+    metrics.sessions_started.inc(scenario=scenario.id, tenant=scenario.tenant)
 
     # Сохраняем событие очистки
-    save_message_to_json(chat_id, "system", "История диалога очищена")
+    if scenario.transcript:
+        save_message_to_json(chat_id, "system", "История диалога очищена", session["persona"])
 
     await update.message.reply_text(
         "🧹 Память очищена! Начинаем новый разговор.\n\n"
         # "Снова начинать... Кажется, это бессмысленно, но ладно..."
         ,
-        reply_markup=get_reply_keyboard(),
+        reply_markup=get_reply_keyboard(scenario),
     )
 
 
 # 6) Функция для получения обратной связи
-async def get_feedback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+async def get_feedback(update: Update, ctx: ContextTypes.DEFAULT_TYPE, scenario: scenarios.Scenario = None):
     chat_id = update.message.chat_id
 
     # Показываем статус "печатает"
     await ctx.bot.send_chat_action(chat_id=chat_id, action="typing")
 
-    # Загружаем всю историю диалога
-    chat_history = load_chat_history(chat_id)
-
-    # Форматируем историю для анализа
-    formatted_history = "\n\n".join(
-        f"{'👤 Психолог' if msg['role'] == 'user' else '🤖 Клиент'}: {msg['content']}"
-        for msg in chat_history["messages"]
-    )
-
-    # Промпт для профессиональной обратной связи
-    feedback_prompt = (
-        "Ты — опытный психолог-супервизор. Проанализируй следующую учебную терапевтическую сессию, "
-        "где психолог отрабатывал навыки работы с нарциссическим клиентом.\n\n"
-        "Дайте профессиональную обратную связь по следующим аспектам:\n"
-        "1. Анализ коммуникативных техник психолога\n"
-        "2. Эффективность работы с депрессивной симптоматикой\n"
-        "3. Установление терапевтического альянса\n"
-        "4. Использование техник активного слушания\n"
-        "5. Работа с сопротивлением и апатией клиента\n"
-        "6. Рекомендации по улучшению техник\n\n"
-        "Формат ответа:\n"
-        "- Краткое резюме сессии\n"
-        "- Сильные стороны работы психолога\n"
-        "- Области для улучшения\n"
-        "- Конкретные рекомендации\n\n"
-        f"История сессии:\n\n{formatted_history}"
-    )
+    # Загружаем всю историю диалога (предварительно дописав очередь на диск)
+    await persist.writer.flush()
+    # чтение и fsync лога — в отдельном потоке, чтобы не блокировать другие чаты
+    chat_history = await asyncio.to_thread(load_chat_history, chat_id)
 
     try:
-        # Получаем обратную связь от DeepSeek
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Ты — психолог-супервизор с 20-летним опытом работы с нарциссическим расстройством.",
-                },
-                {"role": "user", "content": feedback_prompt},
-            ],
-            max_tokens=3000,
-        )
-        feedback = response.choices[0].message.content
-        feedback = asterisk_to_quote(feedback)
+        # Длинные сессии разбираются по сегментам параллельно (см. feedback.py)
+        with metrics.timed(metrics.prompt_build_seconds, stage="feedback"):
+            feedback_messages = await feedback.build_messages(chat_history["messages"])
+
+        if streaming.STREAMING:
+            # Печатаем обратную связь по мере генерации
+            report = await streaming.stream_reply(
+                update.message,
+                llm.stream_completion(
+                    feedback_messages, max_tokens=3000, priority=ratelimit.FEEDBACK
+                ),
+                quotes=False,
+                reply_markup=get_reply_keyboard(scenario),
+                rate_limit_args=ratelimit.FEEDBACK,
+            )
+        else:
+            # Получаем обратную связь от DeepSeek
+            response = await llm.chat_completion(
+                messages=feedback_messages,
+                max_tokens=3000,
+                priority=ratelimit.FEEDBACK,
+            )
+            report = response.choices[0].message.content
 
         # Сохраняем запрос и ответ обратной связи
-        save_message_to_json(chat_id, "user", "Запрос профессиональной обратной связи")
-        save_message_to_json(chat_id, "assistant", feedback)
-
-        # Отправляем обратную связь кусками не более 1024 символов
-        chunk_size = 1024
-        chunks = [
-            feedback[i : i + chunk_size] for i in range(0, len(feedback), chunk_size)
-        ]
-        for idx, chunk in enumerate(chunks):
-            await update.message.reply_text(
-                chunk,
-                parse_mode="Markdown",
-                reply_markup=get_reply_keyboard() if idx == len(chunks) - 1 else None,
+        save_message_to_json(chat_id, "user", feedback.FEEDBACK_REQUEST)
+        save_message_to_json(chat_id, "assistant", report)
+
+        if not streaming.STREAMING:
+            # Отправляем обратную связь сообщениями до 4096 символов,
+            # разрезая по абзацам, а не посреди разметки
+            await streaming.send_reply(
+                update.message,
+                report,
+                quotes=False,
+                reply_markup=get_reply_keyboard(scenario),
+                rate_limit_args=ratelimit.FEEDBACK,
             )
 
     except Exception as e:
         logging.error(f"Ошибка при получении обратной связи: {e}")
         await update.message.reply_text(
             "⚠️ Произошла ошибка при получении профессиональной обратной связи",
-            reply_markup=get_reply_keyboard(),
+            reply_markup=get_reply_keyboard(scenario),
         )
 
 
-# 7) чат-обработчик с поддержкой контекста
+# Кнопки меню обрабатываются по одной, обычные сообщения пачки объединяются
+MENU_BUTTONS = {"✅ Я соглашаюсь", "🧹 Очистить память", "📝 Обратная связь"}
+
+# Действие хода для метрики handler_seconds
+ACTIONS = {
+    "/start": "start",
+    "/clear": "clear",
+    "✅ Я соглашаюсь": "consent",
+    "🧹 Очистить память": "clear",
+    "📝 Обратная связь": "feedback",
+}
+
+
+# 7) чат-обработчик: ставит сообщение в очередь чата (один ход на чат за раз)
 async def chat(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.message.chat_id
     user_message = update.message.text
+    dispatcher.submit(
+        update.message.chat_id,
+        update,
+        ctx,
+        user_message,
+        coalesce=user_message not in MENU_BUTTONS,
+    )
+
+
+# Команды тоже идут через очередь чата: иначе /clear, выполненный посреди хода,
+# был бы перезаписан старой сессией, которую этот ход сохраняет в конце
+async def command(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    name, *args = update.message.text.split()
+    name = name.split("@")[0]
+    # /start <сценарий> — deep link, аргумент передаётся дальше
+    text = f"{name} {args[0]}" if name == "/start" and args else name
+    dispatcher.submit(update.message.chat_id, update, ctx, text, coalesce=False)
+
+
+# Один ход диалога с поддержкой контекста; user_message может объединять
+# несколько сообщений, присланных подряд
+async def chat_turn(update: Update, ctx: ContextTypes.DEFAULT_TYPE, user_message: str):
+    chat_id = update.message.chat_id
+
+    if user_message == "/start" or user_message.startswith("/start "):
+        await start(update, ctx, user_message[len("/start") :].strip())
+        return
+
+    if user_message == "/clear":
+        await clear_history(update, ctx)
+        return
 
     # Если пользователь дал согласие
     if user_message == "✅ Я соглашаюсь":
@@ -407,86 +329,155 @@ async def chat(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await clear_history(update, ctx)
         return
 
-    # Если нажата кнопка "Обратная связь"
-    if user_message == "📝 Обратная связь":
-        await get_feedback(update, ctx)
-        return
+    # Проверяем, дал ли пользователь согласие (сценарию без согласия оно не нужно)
+    history_data = await user_histories.get(chat_id)
+    if history_data is None:
+        scenario = chosen_scenario(ctx)
+        if scenario.consent:
+            await update.message.reply_text(
+                "Пожалуйста, сначала дайте согласие на обработку данных, используя команду /start"
+            )
+            return
+        history_data = await start_session(chat_id, scenario)
+    scenario = scenarios.of(history_data)
 
-    # Проверяем, дал ли пользователь согласие
-    if chat_id not in user_histories:
-        await update.message.reply_text(
-            "Пожалуйста, сначала дайте согласие на обработку данных, используя команду /start"
-        )
+    # Если нажата кнопка "Обратная связь"
+    if user_message == "📝 Обратная связь" and scenario.feedback:
+        await get_feedback(update, ctx, scenario)
         return
 
     # Сохраняем сообщение пользователя
-    save_message_to_json(chat_id, "user", user_message)
+    if scenario.transcript:
+        save_message_to_json(chat_id, "user", user_message)
 
     # Показываем статус "печатает"
     await ctx.bot.send_chat_action(chat_id=chat_id, action="typing")
 
-    history_data = user_histories[chat_id]
-    summary = history_data.get("summary", "")
-    system_message = history_data["system"]
     history = history_data["history"]
 
     # Добавляем текущее сообщение пользователя
     history.append({"role": "user", "content": user_message})
 
-    # Если история превышает окно, удаляем самое старое сообщение и дополняем summary
-    if len(history) > MAX_WINDOW:
-        oldest = history.pop(0)
-        summary = update_summary(summary, oldest)
-        history_data["summary"] = summary
-
-    # Формируем запрос с обновленной историей и summary
-    full_history = [{"role": "system", "content": system_message}]
-    if summary:
-        full_history.append(
-            {"role": "system", "content": f"Обобщенный контекст: {summary}"}
-        )
-    full_history.extend(history)
+    # Формируем запрос: system и summary всегда, затем последние сообщения,
+    # сколько влезает в бюджет токенов сценария; не влезшие вытесняются в summary
+    # (см. prompt.py). Если чат простаивал, промпт уже собран заранее (compactor.py)
+    full_history = prompt.assemble(chat_id, history_data, scenario, compactor.take(chat_id, history_data))
 
-    # Получаем ответ от DeepSeek
+    # Получаем ответ от DeepSeek с настройками модели сценария
+    keyboard = get_reply_keyboard(scenario)
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=full_history,
-            max_tokens=2000,
-        )
-        assistant_reply = response.choices[0].message.content
-        assistant_reply = asterisk_to_quote(assistant_reply)
+        if streaming.STREAMING:
+            # Ответ печатается по мере генерации правками одного сообщения
+            assistant_reply = await streaming.stream_reply(
+                update.message,
+                llm.stream_completion(
+                    full_history,
+                    max_tokens=scenario.max_tokens,
+                    cache=scenario.cache,
+                    **scenario.llm_params,
+                ),
+                quotes=scenario.quotes,
+                reply_markup=keyboard,
+            )
+        else:
+            response = await llm.chat_completion(
+                messages=full_history,
+                max_tokens=scenario.max_tokens,
+                cache=scenario.cache,  # реплики клиента не должны повторяться
+                **scenario.llm_params,
+            )
+            assistant_reply = response.choices[0].message.content
 
         # Добавляем ответ ассистента в историю
         history.append({"role": "assistant", "content": assistant_reply})
         history_data["history"] = history
-        user_histories[chat_id] = history_data
+        await user_histories.put(chat_id, history_data)
+        # пока стажёр читает и печатает, контекст следующего хода готовится заранее
+        compactor.schedule(chat_id, history_data, scenario, user_histories)
 
         # Сохраняем ответ бота
-        save_message_to_json(chat_id, "assistant", assistant_reply)
-
-        # Отправляем ответ
-        await update.message.reply_text(
-            assistant_reply, parse_mode="Markdown", reply_markup=get_reply_keyboard()
-        )
+        if scenario.transcript:
+            save_message_to_json(chat_id, "assistant", assistant_reply)
+
+        # Отправляем ответ (в потоковом режиме он уже отправлен); строки
+        # в *звёздочках* — ремарки клиента — показываются цитатой
+        if not streaming.STREAMING:
+            await streaming.send_reply(
+                update.message, assistant_reply, quotes=scenario.quotes, reply_markup=keyboard
+            )
 
     except Exception as e:
         logging.error(f"Ошибка при обработке сообщения: {e}")
         await update.message.reply_text(
             "⚠️ Произошла ошибка при обработке запроса",
-            reply_markup=get_reply_keyboard(),
+            reply_markup=keyboard,
         )
 
 
-# 8) «Собираем» приложение и запускаем long-polling
-def main() -> None:
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+def action(text: str) -> str:
+    return ACTIONS.get(text.split(" ", 1)[0] if text.startswith("/") else text, "chat")
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("clear", clear_history))
+
+dispatcher = ChatDispatcher(chat_turn, label=action)
+
+metrics.gauge("sessions_resident", "Sessions held in memory", lambda: len(user_histories))
+metrics.gauge("session_messages_resident", "Messages held in memory", lambda: user_histories.gauge()["messages"])
+metrics.gauge("session_bytes_resident", "Message text held in memory, bytes", lambda: user_histories.gauge()["bytes"])
+metrics.gauge("transcript_queue", "Transcript records waiting for flush", persist.writer.pending)
+
+
+# post_init: до него апдейты не принимаются, поэтому здесь же прогреваются пулы
+# соединений и подгружаются активные сессии (своего шарда), см. startup.py
+async def on_startup(app) -> None:
+    persist.writer.start()
+    metrics.serve(int(os.getenv("METRICS_PORT", "0")))
+    await startup.warm(app, user_histories, keep=sharding.owns)
+
+
+# Перед остановкой дописываем на диск всё, что ещё не синхронизировано
+async def on_shutdown(app) -> None:
+    await dispatcher.join()
+    await persist.writer.stop()
+    user_histories.close()
+
+
+# 8) «Собираем» приложение
+def build_application(request=None, updater: bool = True):
+    # concurrent_updates: апдейты разных пользователей обрабатываются параллельно
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .request(request or webhook.telegram_request())
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .rate_limiter(TelegramRateLimiter())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if not updater:
+        # воркер шардированного режима: апдейты приходят от роутера
+        builder = builder.updater(None)
+    app = builder.build()
+
+    app.add_handler(CommandHandler(["start", "clear"], command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, chat))
+    return app
+
+
+# 9) Запускаем long-polling (или webhook, если задан WEBHOOK_URL);
+# при WORKERS > 1 чаты распределяются по процессам-воркерам (см. sharding.py).
+# Процесс с ботом должен быть один: у каждого свой кэш сессий и свой диспетчер,
+# так что реплики за балансировщиком не упорядочивают апдейты одного чата и
+# затирают SQLite устаревшими сессиями. Больше ядер — через WORKERS.
+def main() -> None:
+    if sharding.WORKERS > 1:
+        sharding.run(TELEGRAM_TOKEN, "bot3:build_application")
+        return
 
-    app.run_polling()  # слушаем Telegram
+    app = build_application()
+    if webhook.WEBHOOK_URL:
+        webhook.run(app)  # принимаем апдейты по HTTPS
+    else:
+        app.run_polling()  # слушаем Telegram
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+import metrics
+import storage
+
+# ====== response cache config ======
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1") == "1"  # 0 — кэш выключен целиком
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))  # ответов в памяти (LRU)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 86400)))  # секунд жизни записи
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(storage.CHATS_DIR, "response_cache"))
+RESPONSE_CACHE_MAX_FILES = int(os.getenv("RESPONSE_CACHE_MAX_FILES", "20000"))  # старые записи удаляются
+# ===================================
+
+# Content-addressed cache of deterministic LLM requests (feedback reports,
+# segment analyses, summary folds). The key is a hash of the model, the request
+# parameters and the messages, so any change to a prompt, a template or a token
+# budget is a different key. Hits are served from an in-process LRU first, then
+# from one file per entry on disk, which survives restarts and is shared by the
+# workers of the sharded mode. Persona replies bypass the cache (cache=False in
+# llm.chat_completion / stream_completion): the same message should not get the
+# same reply twice.
+
+llm_cache = metrics.counter("llm_cache_total", "Response cache lookups by result")
+
+
+def make_key(model: str, messages: list, params: dict) -> str:
+    source = json.dumps([model, params, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) store of response payloads with a TTL."""
+
+    def __init__(
+        self,
+        directory: str = RESPONSE_CACHE_DIR,
+        size: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_files: int = RESPONSE_CACHE_MAX_FILES,
+    ):
+        self.directory = directory
+        self.size = size
+        self.ttl = ttl
+        self.max_files = max_files
+        self._memory = OrderedDict()  # key -> (stored at, payload)
+        self._writes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, payload: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _remember(self, key: str, payload: dict, stored: float):
+        self._memory[key] = (stored, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                llm_cache.inc(result="hit", tier="memory")
+                return entry[1]
+            del self._memory[key]
+        payload = await asyncio.to_thread(self._read, key)
+        if payload is None:
+            llm_cache.inc(result="miss", tier="none")
+            return None
+        self._remember(key, payload, time.time())
+        llm_cache.inc(result="hit", tier="disk")
+        return payload
+
+    async def put(self, key: str, payload: dict):
+        self._remember(key, payload, time.time())
+        try:
+            await asyncio.to_thread(self._write, key, payload)
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить ответ в кэш: {e}")
+            return
+        self._writes += 1
+        if self._writes % 100 == 1:
+            await asyncio.to_thread(self.prune)
+
+    def prune(self):
+        """Drops entries older than the TTL, then the oldest ones above max_files."""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+        except FileNotFoundError:
+            return
+        files = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        files.sort()
+        deadline = time.time() - self.ttl
+        excess = len(files) - self.max_files
+        for i, (mtime, path) in enumerate(files):
+            if mtime >= deadline and i >= excess:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        self._memory.clear()
+
+
+responses = ResponseCache()
@@ -0,0 +1,129 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+
+import context
+import metrics
+import prompt
+import summarizer
+
+# ====== idle compaction config ======
+IDLE_COMPACT_AFTER = float(os.getenv("IDLE_COMPACT_AFTER", "20"))  # секунд тишины в чате; 0 — выключено
+IDLE_RESERVE_TOKENS = int(os.getenv("IDLE_RESERVE_TOKENS", "300"))  # запас бюджета под следующую реплику
+IDLE_PREPARED_MAX = int(os.getenv("IDLE_PREPARED_MAX", "1000"))  # готовых промптов в памяти (LRU)
+# ====================================
+
+# Idle-time compaction. Without it the window is trimmed, and the summary
+# updated, only on the turn that overflows it, while the trainee waits; and
+# evicted messages are sent verbatim until a whole batch of them is folded.
+# After every reply a per-chat timer starts; if the chat stays quiet for
+# IDLE_COMPACT_AFTER seconds (the trainee is reading and typing), the compactor
+#
+#   1. evicts what the next turn would evict, leaving IDLE_RESERVE_TOKENS of the
+#      budget for the next message,
+#   2. waits for a summary fold in flight, and folds the pending messages now if
+#      they make a whole batch or no longer fit the budget next to the prefix
+#      (a smaller remainder waits for the batch, so quiet chats do not cost a
+#      summary call per turn),
+#   3. packs the prompt for the next turn and keeps it (with its token count).
+#
+# The next turn takes the prepared prompt and only appends the new message, if
+# nothing changed meanwhile and the message fits; otherwise the prompt is packed
+# as usual. A new message cancels the timer (a fold already started finishes in
+# the background), and clear_history() discards both the timer and the
+# prepared prompt through discard(), next to summarizer.cancel().
+
+_timers = {}  # chat_id -> asyncio.Task
+_prepared = OrderedDict()  # chat_id -> (session, state, messages, tokens)
+
+idle_compactions = metrics.counter("idle_compactions_total", "Idle compactions and use of their prompts by result")
+
+
+def _state(session: dict) -> tuple:
+    # всё, от чего зависит собранный промпт; история растёт только с конца
+    return len(session["history"]), len(summarizer.pending(session)), session.get("summary", "")
+
+
+def schedule(chat_id: int, session: dict, scenario, store=None):
+    """Starts the idle timer after a turn; it compacts the chat if no update comes."""
+    if IDLE_COMPACT_AFTER <= 0:
+        return
+    _cancel_timer(chat_id)
+    task = asyncio.create_task(_idle(chat_id, session, scenario, store))
+    _timers[chat_id] = task
+    task.add_done_callback(lambda t: _timers.pop(chat_id, None) if _timers.get(chat_id) is t else None)
+
+
+def take(chat_id: int, session: dict):
+    """
+    Called when a turn starts, after its user message was appended: stops the
+    timer and returns (messages, tokens) prepared for this state, or None.
+    """
+    _cancel_timer(chat_id)
+    entry = _prepared.pop(chat_id, None)
+    if entry is None:
+        return None
+    prepared_session, state, messages, tokens = entry
+    length, pending, summary = _state(session)
+    if prepared_session is not session or state != (length - 1, pending, summary):
+        idle_compactions.inc(result="stale")
+        return None
+    idle_compactions.inc(result="used")
+    return messages, tokens
+
+
+def discard(chat_id: int):
+    """Drops the timer and the prepared prompt (the session was cleared)."""
+    _cancel_timer(chat_id)
+    _prepared.pop(chat_id, None)
+
+
+def _cancel_timer(chat_id: int):
+    task = _timers.pop(chat_id, None)
+    if task is not None:
+        task.cancel()
+
+
+async def _idle(chat_id: int, session: dict, scenario, store):
+    await asyncio.sleep(IDLE_COMPACT_AFTER)
+    try:
+        await compact(chat_id, session, scenario)
+        if store is not None:
+            await store.save(chat_id)
+    except Exception as e:
+        logging.error(f"Ошибка при фоновом сжатии контекста: {e}")
+
+
+def _should_fold(session: dict, scenario, budget: int) -> bool:
+    pending = summarizer.pending(session)
+    if not pending:
+        return False
+    if len(pending) >= scenario.summary_batch:
+        return True
+    _, cut = context.pack(prompt.prefix(session), pending + session["history"], budget)
+    return cut > 0
+
+
+async def compact(chat_id: int, session: dict, scenario):
+    """Brings an idle chat to the state its next turn would need, and prepares the prompt."""
+    budget = max(0, scenario.context_budget - IDLE_RESERVE_TOKENS)
+    with metrics.timed(metrics.handler_seconds, handler="idle_compact"):
+        prompt.pack(chat_id, session, scenario, budget)
+        if scenario.summary:
+            await summarizer.wait(chat_id)
+            if _should_fold(session, scenario, budget):
+                await summarizer.flush(chat_id, session, scenario.summary_maxtok)
+        # summary могло вырасти — собираем заново; готовим, только если влезло всё
+        messages, cut = context.pack(
+            prompt.prefix(session), summarizer.pending(session) + session["history"], budget
+        )
+    if cut:
+        idle_compactions.inc(result="overflow")
+        return
+    tokens = sum(context.message_tokens(m) for m in messages)
+    _prepared[chat_id] = (session, _state(session), messages, tokens)
+    _prepared.move_to_end(chat_id)
+    while len(_prepared) > IDLE_PREPARED_MAX:
+        _prepared.popitem(last=False)
+    idle_compactions.inc(result="prepared")
@@ -0,0 +1,67 @@
+import os
+import logging
+from functools import lru_cache
+
+# ====== context window config ======
+CONTEXT_BUDGET = int(os.getenv("CONTEXT_BUDGET", "3000"))  # prompt tokens: system + summary + recent turns
+TOKENIZER = os.getenv("TOKENIZER", "approx")  # approx | tiktoken
+MESSAGE_OVERHEAD = 4  # служебные токены роли/разделителей на каждое сообщение
+# ===================================
+
+
+def approx_tokens(text: str) -> int:
+    """Fast estimate: ~4 chars per token for Latin text, ~3 for Cyrillic and the rest."""
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 2) // 3
+
+
+def _load_tokenizer():
+    if TOKENIZER == "tiktoken":
+        try:
+            import tiktoken
+
+            enc = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(enc.encode(text))
+        except ImportError:
+            logging.warning("tiktoken не установлен, используем приближённый подсчёт токенов")
+    return approx_tokens
+
+
+_tokenize = _load_tokenizer()
+
+
+def set_tokenizer(fn):
+    """Plugs in another tokenizer (callable text -> number of tokens)."""
+    global _tokenize
+    _tokenize = fn
+    count_tokens.cache_clear()
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text: str) -> int:
+    # кэш по строке: сообщения истории считаются один раз, а не на каждом ходе
+    return _tokenize(text)
+
+
+def message_tokens(msg: dict) -> int:
+    return count_tokens(msg["content"]) + MESSAGE_OVERHEAD
+
+
+def pack(prefix: list, recent: list, budget: int = None) -> tuple:
+    """
+    Packs the prompt into a token budget: the prefix (system prompt, summary) always
+    goes in, then as many of the most recent messages as fit, newest last.
+    The last message is always included, even if it alone exceeds the budget.
+
+    Returns (messages, cut): recent[:cut] did not fit.
+    """
+    budget = CONTEXT_BUDGET if budget is None else budget
+    left = budget - sum(message_tokens(m) for m in prefix)
+    cut = len(recent)
+    while cut > 0:
+        cost = message_tokens(recent[cut - 1])
+        if cost > left and cut < len(recent):
+            break
+        left -= cost
+        cut -= 1
+    return prefix + recent[cut:], cut
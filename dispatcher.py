@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import logging
+
+import metrics
+
+# ====== dispatcher config ======
+COALESCE_DEBOUNCE = float(os.getenv("COALESCE_DEBOUNCE", "0.5"))  # секунд ждём следующих сообщений пачки
+# ===============================
+
+
+class ChatDispatcher:
+    """
+    Runs at most one turn per chat at a time.
+
+    Updates of a chat are queued and handled in arrival order by a single task.
+    Consecutive plain messages (a burst, or anything that arrived while the
+    previous turn was running) are joined into one user turn after a short
+    debounce; control messages (buttons) are handled one by one.
+    """
+
+    def __init__(self, handler, debounce: float = COALESCE_DEBOUNCE, label=None):
+        self.handler = handler  # async handler(update, ctx, text)
+        self.debounce = debounce
+        # label(text) -> имя действия для метрик (consent, clear, feedback, chat...)
+        self.label = label or (lambda text: handler.__name__)
+        self._queues = {}  # chat_id -> list of (update, ctx, text, coalesce, enqueued at)
+        self._tasks = {}  # chat_id -> asyncio.Task
+
+    def submit(self, chat_id: int, update, ctx, text: str, coalesce: bool = True):
+        self._queues.setdefault(chat_id, []).append(
+            (update, ctx, text, coalesce, time.perf_counter())
+        )
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                if queue[0][3] and self.debounce > 0:
+                    await asyncio.sleep(self.debounce)
+
+                update, ctx, text, coalesce, enqueued = queue.pop(0)
+                if coalesce:
+                    parts = [text]
+                    while queue and queue[0][3]:
+                        update, ctx, more, _, _ = queue.pop(0)
+                        parts.append(more)
+                    text = "\n".join(parts)
+                    if len(parts) > 1:
+                        logging.info(f"Чат {chat_id}: {len(parts)} сообщений объединены в один ход")
+
+                metrics.queue_wait_seconds.observe(time.perf_counter() - enqueued)
+                try:
+                    with metrics.timed(metrics.handler_seconds, handler=self.label(text)):
+                        await self.handler(update, ctx, text)
+                except Exception as e:
+                    logging.error(f"Ошибка в обработчике чата {chat_id}: {e}")
+        finally:
+            del self._tasks[chat_id]
+            del self._queues[chat_id]
+
+    async def join(self):
+        """Waits for all queued turns (used on shutdown)."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
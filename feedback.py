@@ -0,0 +1,136 @@
+import os
+import asyncio
+
+import llm
+import context
+from ratelimit import FEEDBACK
+
+# ====== feedback config ======
+FEEDBACK_SEGMENT_TOKENS = int(os.getenv("FEEDBACK_SEGMENT_TOKENS", "6000"))  # токенов транскрипта на сегмент
+FEEDBACK_SEGMENT_MAXTOK = int(os.getenv("FEEDBACK_SEGMENT_MAXTOK", "600"))  # бюджет на разбор одного сегмента
+# =============================
+
+# Long sessions are analysed map-reduce style: the transcript is cut into
+# token-bounded segments from the start, each segment is analysed concurrently,
+# and the supervisor report is written from the partial analyses.
+# Segments are cut greedily from the beginning, so earlier segments stay identical
+# as the session grows and their analyses are reused from the response cache
+# (cache.py), as is the whole report while the transcript has not changed.
+
+# Так запрос обратной связи записывается в транскрипт
+FEEDBACK_REQUEST = "Запрос профессиональной обратной связи"
+
+SUPERVISOR_SYSTEM = "Ты — психолог-супервизор с 20-летним опытом работы с нарциссическим расстройством."
+
+REPORT_TASK = (
+    "Дайте профессиональную обратную связь по следующим аспектам:\n"
+    "1. Анализ коммуникативных техник психолога\n"
+    "2. Эффективность работы с депрессивной симптоматикой\n"
+    "3. Установление терапевтического альянса\n"
+    "4. Использование техник активного слушания\n"
+    "5. Работа с сопротивлением и апатией клиента\n"
+    "6. Рекомендации по улучшению техник\n\n"
+    "Формат ответа:\n"
+    "- Краткое резюме сессии\n"
+    "- Сильные стороны работы психолога\n"
+    "- Области для улучшения\n"
+    "- Конкретные рекомендации\n\n"
+)
+
+
+def session_messages(messages: list) -> list:
+    """The transcript without earlier feedback requests and the reports that answered them."""
+    out, skip = [], False
+    for msg in messages:
+        if msg["role"] == "user" and msg["content"] == FEEDBACK_REQUEST:
+            skip = True
+            continue
+        if skip and msg["role"] == "assistant":
+            skip = False
+            continue
+        skip = False
+        out.append(msg)
+    return out
+
+
+def format_message(msg: dict) -> str:
+    return f"{'👤 Психолог' if msg['role'] == 'user' else '🤖 Клиент'}: {msg['content']}"
+
+
+def split_segments(lines: list, budget: int = FEEDBACK_SEGMENT_TOKENS) -> list:
+    """Greedy token-bounded segments; a single overlong line gets its own segment."""
+    segments, current, used = [], [], 0
+    for line in lines:
+        cost = context.count_tokens(line)
+        if current and used + cost > budget:
+            segments.append(current)
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        segments.append(current)
+    return segments
+
+
+def segment_prompt(text: str, index: int) -> str:
+    # общее число частей в промпт не входит: иначе разборы старых сегментов
+    # устаревали бы с каждым новым сегментом
+    return (
+        f"Это часть {index + 1} учебной терапевтической сессии, где психолог "
+        "отрабатывал навыки работы с нарциссическим клиентом. Кратко выпиши наблюдения "
+        "по этой части: какие техники использовал психолог, как реагировал клиент, "
+        "удачные и неудачные моменты (с короткими цитатами). Без общих выводов.\n\n"
+        f"Фрагмент сессии:\n\n{text}"
+    )
+
+
+async def analyse_segment(text: str, index: int) -> str:
+    """Partial supervisor notes for one segment (cached by llm.chat_completion)."""
+    response = await llm.chat_completion(
+        messages=[
+            {"role": "system", "content": SUPERVISOR_SYSTEM},
+            {"role": "user", "content": segment_prompt(text, index)},
+        ],
+        max_tokens=FEEDBACK_SEGMENT_MAXTOK,
+        priority=FEEDBACK,
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def build_messages(messages: list) -> list:
+    """
+    Request for the final supervisor report. Short sessions go in whole; long ones
+    are replaced by concurrently produced per-segment analyses.
+    """
+    lines = [format_message(msg) for msg in session_messages(messages)]
+    segments = split_segments(lines)
+
+    if len(segments) <= 1:
+        prompt = (
+            "Ты — опытный психолог-супервизор. Проанализируй следующую учебную терапевтическую сессию, "
+            "где психолог отрабатывал навыки работы с нарциссическим клиентом.\n\n"
+            + REPORT_TASK
+            + "История сессии:\n\n"
+            + "\n\n".join(lines)
+        )
+    else:
+        notes = await asyncio.gather(
+            *(
+                analyse_segment("\n\n".join(segment), i)
+                for i, segment in enumerate(segments)
+            )
+        )
+        partials = "\n\n".join(f"Часть {i + 1}:\n{n}" for i, n in enumerate(notes))
+        prompt = (
+            "Ты — опытный психолог-супервизор. Учебная терапевтическая сессия, где психолог "
+            "отрабатывал навыки работы с нарциссическим клиентом, была длинной, поэтому ниже "
+            "приведены наблюдения по её последовательным частям. Составь по ним единый отчёт.\n\n"
+            + REPORT_TASK
+            + "Наблюдения по частям сессии:\n\n"
+            + partials
+        )
+
+    return [
+        {"role": "system", "content": SUPERVISOR_SYSTEM},
+        {"role": "user", "content": prompt},
+    ]
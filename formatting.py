@@ -0,0 +1,245 @@
+import re
+
+# ====== formatting config ======
+TELEGRAM_LIMIT = 4096  # максимальная длина сообщения Telegram
+# ===============================
+
+# Model output (loose Markdown) -> Telegram MarkdownV2, in one pass per line.
+#
+# Every line is rendered once, by compiled patterns, and never revisited:
+#   "# Заголовок" (up to ######)   -> *bold*
+#   a line wrapped in *asterisks*  -> > block quote (persona stage directions)
+#   **bold**, *italic*, `code`     -> the MarkdownV2 entities
+#   ``` fences                     -> pre blocks
+# and everything else is escaped, so the result always parses. Entities never
+# span lines (except pre blocks, which are closed and reopened at a split), so a
+# message can be cut at any line boundary; cuts prefer a paragraph break.
+#
+# Formatter is incremental: feed() it stream deltas and it hands back finished
+# messages as soon as they are full, plus a valid preview of the message being
+# typed. render() and split() are the one-shot forms.
+
+_SPECIAL = "_*[]()~`>#+-=|{}.!"  # плюс сам обратный слеш
+_ENTITY = re.compile(
+    r"\*\*(?P<bold>[^*\n]+?)\*\*"
+    r"|\*(?P<italic>[^*\s](?:[^*\n]*?[^*\s])?)\*"
+    r"|`(?P<code>[^`\n]+)`"
+)
+_HEADING = re.compile(r"#{1,6}\s*(.*)")
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+def escape(text: str) -> str:
+    """Escapes text for MarkdownV2 outside of entities."""
+    # цепочка str.replace с проверкой `in` заметно быстрее и re.sub с обратной
+    # ссылкой (шаблон раскрывается в Python на каждое совпадение), и translate
+    # по словарю (медленный путь для кириллицы)
+    if "\\" in text:
+        text = text.replace("\\", "\\\\")
+    for ch in _SPECIAL:
+        if ch in text:
+            text = text.replace(ch, "\\" + ch)
+    return text
+
+
+def escape_code(text: str) -> str:
+    """Escapes text inside `code` and ``` blocks, where only ` and \\ are special."""
+    return text.replace("\\", "\\\\").replace("`", "\\`")
+
+
+def _entity(match) -> str:
+    kind = match.lastgroup
+    value = match.group(kind)
+    if kind == "code":
+        return "`" + escape_code(value) + "`"
+    mark = "*" if kind == "bold" else "_"
+    return mark + escape(value) + mark
+
+
+def render_inline(text: str) -> str:
+    """**bold**, *italic* and `code` to MarkdownV2 entities, the rest escaped."""
+    if "*" not in text and "`" not in text:
+        return escape(text)
+    parts, pos = [], 0
+    for match in _ENTITY.finditer(text):
+        parts.append(escape(text[pos : match.start()]))
+        parts.append(_entity(match))
+        pos = match.end()
+    parts.append(escape(text[pos:]))
+    return "".join(parts)
+
+
+def split_point(text: str, limit: int) -> int:
+    """Where to cut an overlong text: last line break, else last space."""
+    cut = text.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind(" ", 0, limit)
+    return cut if cut > 0 else limit
+
+
+class Formatter:
+    """
+    Incremental renderer and splitter. feed(delta) returns the messages that
+    were completed by this delta; finish() returns the rest. `quotes` turns
+    whole-line *asterisks* into block quotes (bot3's persona style).
+    """
+
+    def __init__(self, limit: int = TELEGRAM_LIMIT, quotes: bool = True):
+        self.limit = limit
+        self.quotes = quotes
+        self._tail = ""  # незавершённая строка
+        self._lines = []  # готовые строки текущего сообщения (MarkdownV2)
+        self._size = -1  # длина "\n".join(self._lines)
+        self._fence = None  # язык открытого ``` блока, "" — без языка
+
+    # -- строки ---------------------------------------------------------------
+
+    def _render(self, line: str, fence):
+        """Renders one complete line; returns it with the ``` state after it."""
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if fence is None:
+                fence = stripped[3:].strip().replace("`", "").replace("\\", "")
+                return "```" + fence, fence
+            return "```", None
+        if fence is not None:
+            return escape_code(line), fence
+        if line.startswith("#"):
+            heading = _HEADING.match(line).group(1).strip()
+            return (f"*{escape(heading)}*" if heading else ""), None
+        if self.quotes and len(stripped) > 1 and stripped[0] == "*" and stripped[-1] == "*":
+            content = stripped.strip("*").strip()
+            return (">" + render_inline(content) if content else ""), None
+        return render_inline(line), None
+
+    def _add(self, rendered: str, fence, out: list):
+        # внутри блока кода держим место под закрывающий ```, которым блок
+        # закроется, если сообщение придётся резать
+        reserve = 4 if fence is not None else 0
+        while self._lines and self._size + 1 + len(rendered) + reserve > self.limit:
+            text = self._cut()
+            if not text:
+                break
+            out.append(text)
+        self._lines.append(rendered)
+        self._size += 1 + len(rendered)
+        self._fence = fence
+
+    def _cut(self) -> str:
+        """
+        Emits the current message: up to the last paragraph break in its second
+        half, or all of it. An open ``` block is closed and reopened in the next one.
+        """
+        lines = self._lines
+        cut = len(lines)
+        if self._fence is None:
+            for i in range(len(lines) - 1, len(lines) // 2, -1):
+                if lines[i] == "":
+                    cut = i
+                    break
+        head, rest = lines[:cut], lines[cut + 1 :]
+        if self._fence is not None:
+            opening = "```" + self._fence
+            if lines[-1] == opening:
+                # блок только что открыт — переносим его в следующее сообщение целиком
+                head, rest = lines[:-1], [opening]
+            else:
+                head, rest = lines + ["```"], [opening]
+        self._lines = rest
+        self._size = len("\n".join(rest)) if rest else -1
+        return "\n".join(head).strip("\n")
+
+    def _line(self, line: str, out: list):
+        rendered, fence = self._render(line, self._fence)
+        # место под открывающую и закрывающую строки блока кода
+        room = self.limit - 1 - (len(fence) + 8 if fence is not None else 0)
+        if len(rendered) <= room:
+            self._add(rendered, fence, out)
+            return
+        # одна строка длиннее сообщения: режем по словам, куски рендерятся отдельно
+        stripped = line.strip()
+        quote = self.quotes and fence is None and stripped[:1] == "*" and stripped[-1:] == "*"
+        if quote:
+            line = stripped.strip("*").strip()
+        while line:
+            size = room
+            while True:
+                cut = split_point(line, size) if len(line) > size else len(line)
+                if quote:
+                    rendered, fence = ">" + render_inline(line[:cut]), None
+                else:
+                    rendered, fence = self._render(line[:cut], self._fence)
+                if len(rendered) <= room or size < 16:
+                    break
+                size = size * 3 // 4
+            self._add(rendered, fence, out)
+            line = line[cut:].lstrip()
+
+    # -- API ------------------------------------------------------------------
+
+    def feed(self, delta: str) -> list:
+        out = []
+        self._tail += delta
+        if "\n" in self._tail:
+            *complete, self._tail = self._tail.split("\n")
+            for line in complete:
+                self._line(line, out)
+        # незаконченная строка сама по себе длиннее сообщения
+        while len(self._tail) > self.limit:
+            cut = split_point(self._tail, self.limit)
+            self._line(self._tail[:cut], out)
+            self._tail = self._tail[cut:].lstrip()
+        if self._tail and self._lines:
+            # набираемая строка не влезает в текущее сообщение — оно готово
+            # (экранирование не более чем удваивает длину: точно считаем только у границы)
+            reserve = 4 if self._fence is not None else 0
+            room = self.limit - self._size - 1 - reserve
+            if 2 * len(self._tail) > room and len(self._escape_tail(self._tail)) > room:
+                text = self._cut()
+                if text:
+                    out.append(text)
+        return out
+
+    def _escape_tail(self, tail: str) -> str:
+        return escape_code(tail) if self._fence is not None else escape(tail)
+
+    def preview(self) -> str:
+        """Valid MarkdownV2 of the message being typed (unfinished line shown plain)."""
+        tail = self._escape_tail(self._tail) if self._tail else ""
+        if len(tail) > self.limit - 4:
+            tail = self._escape_tail(self._tail[: split_point(self._tail, self.limit // 2)])
+        text = "\n".join(self._lines + [tail]) if tail else "\n".join(self._lines)
+        if self._fence is not None:
+            text += "\n```"
+        return text.strip("\n")
+
+    def finish(self) -> list:
+        out = []
+        if self._tail:
+            self._line(self._tail, out)
+            self._tail = ""
+        if self._fence is not None:
+            self._lines.append("```")
+            self._fence = None
+        text = "\n".join(self._lines).strip("\n")
+        if text:
+            out.append(text)
+        self._lines, self._size = [], -1
+        return out
+
+
+def plain(text: str) -> str:
+    """Drops MarkdownV2 escapes: the fallback if Telegram still rejects a message."""
+    return _UNESCAPE.sub(r"\1", text)
+
+
+def split(text: str, limit: int = TELEGRAM_LIMIT, quotes: bool = True) -> list:
+    """Renders text to MarkdownV2 messages of at most `limit` characters."""
+    formatter = Formatter(limit, quotes)
+    return formatter.feed(text) + formatter.finish()
+
+
+def render(text: str, quotes: bool = True) -> str:
+    """Renders text to MarkdownV2 as a single message, whatever its length."""
+    formatter = Formatter(float("inf"), quotes)
+    return "\n".join(formatter.feed(text) + formatter.finish())
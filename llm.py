@@ -0,0 +1,293 @@
+import os
+import time
+import asyncio
+import logging
+import importlib
+
+import context
+import metrics
+from cache import RESPONSE_CACHE, make_key, responses
+import ratelimit
+import webhook
+from ratelimit import INTERACTIVE, FEEDBACK, BACKGROUND
+
+# ====== LLM client config ======
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # секунд на один вызов
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))  # одновременных запросов
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "60"))  # секунд держим простаивающее соединение
+# ===============================
+
+# openai (и httpx под ним) — самый тяжёлый импорт бота, ~2/3 времени холодного
+# старта; он откладывается до первого клиента, так что роутер шардированного
+# режима и утилиты без LLM его не загружают вовсе, а startup.py грузит его
+# в потоке, пока идут остальные шаги старта
+_client = None
+# слоты и лимиты раздаются по приоритету: ответы в чате обгоняют
+# обратную связь и фоновые summary (см. ratelimit.py)
+_semaphore = ratelimit.PrioritySemaphore(LLM_CONCURRENCY)
+_requests = ratelimit.TokenBucket(ratelimit.LLM_RPM)
+_tokens = ratelimit.TokenBucket(ratelimit.LLM_TPM)
+_retry_budget = ratelimit.RetryBudget()
+
+# метка stage в метриках выводится из приоритета вызова
+STAGES = {INTERACTIVE: "chat", FEEDBACK: "feedback", BACKGROUND: "summary"}
+
+# Накопленная статистика токенов; DeepSeek возвращает prompt_cache_hit_tokens
+# и prompt_cache_miss_tokens — по ним видно, насколько срабатывает кэш префикса
+usage_stats = {
+    "requests": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "cache_hit_tokens": 0,
+    "cache_miss_tokens": 0,
+}
+
+
+def get_client():
+    """Возвращает общий асинхронный клиент DeepSeek (создаётся при первом вызове)."""
+    global _client
+    if _client is None:
+        import httpx
+        import openai
+
+        _client = openai.AsyncOpenAI(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url=DEEPSEEK_BASE_URL,
+            timeout=LLM_TIMEOUT,
+            max_retries=0,  # повторы делает with_retries с общим бюджетом
+            # пул keep-alive соединений по размеру лимита параллельных запросов
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_CONCURRENCY,
+                    max_keepalive_connections=LLM_CONCURRENCY,
+                    keepalive_expiry=LLM_KEEPALIVE,
+                ),
+                http2=webhook.http2_enabled(),
+            ),
+        )
+    return _client
+
+
+def record_usage(usage, stage: str = "chat"):
+    """Adds response.usage to usage_stats and metrics and logs the prompt cache hit rate."""
+    if usage is None:
+        return
+    hit = getattr(usage, "prompt_cache_hit_tokens", None) or 0
+    miss = getattr(usage, "prompt_cache_miss_tokens", None) or 0
+    metrics.llm_tokens.inc(usage.prompt_tokens or 0, stage=stage, kind="prompt")
+    metrics.llm_tokens.inc(usage.completion_tokens or 0, stage=stage, kind="completion")
+    metrics.llm_tokens.inc(hit, stage=stage, kind="cached")
+    usage_stats["requests"] += 1
+    usage_stats["prompt_tokens"] += usage.prompt_tokens or 0
+    usage_stats["completion_tokens"] += usage.completion_tokens or 0
+    usage_stats["cache_hit_tokens"] += hit
+    usage_stats["cache_miss_tokens"] += miss
+    if hit or miss:
+        total_hit = usage_stats["cache_hit_tokens"]
+        total = total_hit + usage_stats["cache_miss_tokens"]
+        logging.info(
+            f"LLM cache: {hit}/{hit + miss} prompt tokens из кэша "
+            f"(всего {total_hit}/{total}, {total_hit / total:.0%})"
+        )
+
+
+async def warm(connections: int = 1, timeout: float = 10.0) -> int:
+    """
+    Opens up to `connections` keep-alive connections to the API before the
+    first real request (GET /models: no tokens spent). Returns how many succeeded.
+    """
+    # импорт — в потоке (цикл событий тем временем занят Telegram), клиент — здесь
+    await asyncio.to_thread(importlib.import_module, "openai")
+    client = get_client()
+
+    async def one():
+        await asyncio.wait_for(client.models.list(), timeout)
+
+    results = await asyncio.gather(
+        *(one() for _ in range(max(1, min(connections, LLM_CONCURRENCY)))), return_exceptions=True
+    )
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed:
+        logging.warning(f"Прогрев LLM: {len(failed)}/{len(results)} соединений не открылись: {failed[0]!r}")
+    return len(results) - len(failed)
+
+
+def _is_retryable(e: Exception) -> bool:
+    import openai
+
+    return isinstance(
+        e,
+        (
+            asyncio.TimeoutError,
+            openai.RateLimitError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        ),
+    )
+
+
+def _retry_after(e: Exception):
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+async def _admit(messages: list, max_tokens: int, priority: int):
+    """Waits for the requests/min and tokens/min buckets."""
+    estimate = sum(context.message_tokens(m) for m in messages) + (max_tokens or 0)
+    await _requests.acquire(1, priority)
+    await _tokens.acquire(estimate, priority)
+
+
+async def chat_completion(
+    messages: list,
+    max_tokens: int = None,
+    timeout: float = None,
+    priority: int = INTERACTIVE,
+    cache: bool = True,
+    **params,
+):
+    """
+    Sends one chat completion request without blocking the event loop.
+    At most LLM_CONCURRENCY requests are in flight; the timeout covers the call itself,
+    not the time spent waiting for a free slot. 429s, 5xx, connection errors and
+    timeouts are retried with jittered backoff within the global retry budget.
+    Identical requests are answered from the response cache (see cache.py) unless
+    cache=False, which persona replies use. A cached response has usage=None:
+    it cost no tokens.
+    """
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    timeout = timeout or LLM_TIMEOUT
+    model = params.pop("model", LLM_MODEL)
+    key = make_key(model, messages, params) if cache and RESPONSE_CACHE else None
+    if key:
+        payload = await responses.get(key)
+        if payload is not None:
+            from openai.types.chat import ChatCompletion
+
+            # usage в кэше — от исходного запроса, этот ничего не стоил
+            return ChatCompletion.model_validate(dict(payload, usage=None))
+
+    async def attempt():
+        await _admit(messages, max_tokens, priority)
+        async with _semaphore.slot(priority):
+            try:
+                return await asyncio.wait_for(
+                    get_client().chat.completions.create(
+                        model=model, messages=messages, **params
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                logging.error(f"Таймаут запроса к LLM ({timeout} с)")
+                raise
+
+    stage = STAGES.get(priority, "chat")
+    with metrics.timed(metrics.llm_seconds, stage=stage):
+        response = await ratelimit.with_retries(
+            attempt, _is_retryable, _retry_after, _retry_budget, what="LLM"
+        )
+    record_usage(response.usage, stage)
+    if key:
+        await responses.put(key, response.model_dump(exclude_unset=True))
+    return response
+
+
+async def stream_completion(
+    messages: list,
+    max_tokens: int = None,
+    timeout: float = None,
+    priority: int = INTERACTIVE,
+    cache: bool = True,
+    **params,
+):
+    """
+    Streams a chat completion, yielding text deltas as they arrive.
+    The timeout bounds the wait for the stream to open and for each next chunk.
+    Only opening the stream is retried: once text has been shown it cannot be taken back.
+    A cached response (shared with chat_completion) is yielded as a single delta.
+    """
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    timeout = timeout or LLM_TIMEOUT
+    model = params.pop("model", LLM_MODEL)
+    stage = STAGES.get(priority, "chat")
+    key = make_key(model, messages, params) if cache and RESPONSE_CACHE else None
+    if key:
+        payload = await responses.get(key)
+        if payload is not None:
+            yield payload["choices"][0]["message"]["content"]
+            return
+    start = time.perf_counter()
+    first = True
+    parts, finish = [], None
+
+    async def attempt():
+        await _admit(messages, max_tokens, priority)
+        await _semaphore.acquire(priority)
+        try:
+            return await asyncio.wait_for(
+                get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **params,
+                ),
+                timeout,
+            )
+        except BaseException:
+            _semaphore.release()
+            raise
+
+    # слот занимается на каждую попытку и держится, пока идёт поток
+    stream = await ratelimit.with_retries(
+        attempt, _is_retryable, _retry_after, _retry_budget, what="LLM stream"
+    )
+    try:
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                logging.error(f"Таймаут потока LLM ({timeout} с)")
+                raise
+            # usage приходит последним чанком без choices
+            record_usage(getattr(chunk, "usage", None), stage)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first:
+                    metrics.llm_ttft_seconds.observe(time.perf_counter() - start, stage=stage)
+                    first = False
+                if key:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        _semaphore.release()
+    metrics.llm_seconds.observe(time.perf_counter() - start, stage=stage)
+    if key and finish:
+        # в том же виде, что и ответ chat_completion, чтобы запись подходила обоим
+        await responses.put(
+            key,
+            {
+                "id": "cached",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(parts)},
+                        "finish_reason": finish,
+                    }
+                ],
+            },
+        )
@@ -0,0 +1,187 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ====== metrics config ======
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — не поднимать /metrics
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "0") == "1"  # спаны OpenTelemetry, если пакет установлен
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+# ============================
+
+# Minimal Prometheus-style registry. Latencies are histograms, so p50/p95/p99 come
+# from histogram_quantile() on the Prometheus side; cost per session is
+# llm_tokens_total / sessions_started_total.
+
+_lock = threading.Lock()
+_registry = {}  # name -> metric
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str):
+        self.name, self.doc = name, doc
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, dict(key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.buckets = name, doc, buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self):
+        for key, row in self._values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, row):
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, row[-1]
+            yield f"{self.name}_sum", labels, row[-2]
+            yield f"{self.name}_count", labels, row[-1]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn):
+        self.name, self.doc, self.fn = name, doc, fn  # fn() -> число или {labels: число}
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in value.items():
+                yield self.name, dict(key), v
+        else:
+            yield self.name, {}, value
+
+
+def counter(name: str, doc: str) -> Counter:
+    return _registry.setdefault(name, Counter(name, doc))
+
+
+def histogram(name: str, doc: str, buckets=LATENCY_BUCKETS) -> Histogram:
+    return _registry.setdefault(name, Histogram(name, doc, buckets))
+
+
+def gauge(name: str, doc: str, fn) -> Gauge:
+    _registry[name] = Gauge(name, doc, fn)
+    return _registry[name]
+
+
+# --- stage metrics -------------------------------------------------------
+handler_seconds = histogram("handler_seconds", "Handler wall time")
+queue_wait_seconds = histogram("queue_wait_seconds", "Time an update waited for its chat's turn")
+prompt_build_seconds = histogram("prompt_build_seconds", "Prompt assembly time")
+llm_seconds = histogram("llm_seconds", "LLM call latency, total")
+llm_ttft_seconds = histogram("llm_ttft_seconds", "LLM time to first token (streaming)")
+llm_tokens = counter("llm_tokens_total", "Tokens reported by response.usage")
+storage_seconds = histogram("storage_seconds", "Transcript/session persistence time")
+telegram_seconds = histogram("telegram_seconds", "Telegram Bot API request time")
+sessions_started = counter("sessions_started_total", "Sessions started (consent or clear)")
+# -------------------------------------------------------------------------
+
+
+def _tracer():
+    if not OTEL_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("OTEL_ENABLED=1, но opentelemetry не установлен")
+        return None
+    return trace.get_tracer("lpsh_narc_bot")
+
+
+_otel = _tracer()
+
+
+@contextmanager
+def timed(hist: Histogram, **labels):
+    """Observes the wall time of the block in `hist`; also opens an OTel span if enabled."""
+    start = time.perf_counter()
+    if _otel is None:
+        try:
+            yield
+        finally:
+            hist.observe(time.perf_counter() - start, **labels)
+        return
+    with _otel.start_as_current_span(hist.name, attributes=labels):
+        try:
+            yield
+        finally:
+            hist.observe(time.perf_counter() - start, **labels)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render() -> str:
+    """Prometheus text exposition of every registered metric."""
+    lines = []
+    with _lock:
+        for metric in _registry.values():
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = None):
+    """Starts the /metrics endpoint in a daemon thread (no-op when port is 0)."""
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Метрики доступны на :{port}/metrics")
+    return server
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import logging
+
+import storage
+import metrics
+
+# ====== write-behind config ======
+FLUSH_BATCH = int(os.getenv("FLUSH_BATCH", "64"))  # сбрасываем, когда накопилось столько записей…
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "0.5"))  # …или раз в столько секунд
+# =================================
+
+
+class WriteBehind:
+    """
+    Write-behind queue for chat transcripts.
+
+    Handlers call enqueue() and return immediately; a background task groups the
+    pending records by chat_id and appends them to storage.py from a worker thread.
+    Flushes never overlap, so messages of one chat reach disk in enqueue order.
+    Chats whose records failed to write go back to the front of the queue and
+    are retried on the next tick.
+    """
+
+    def __init__(self, batch: int = FLUSH_BATCH, interval: float = FLUSH_INTERVAL):
+        self.batch = batch
+        self.interval = interval
+        self.on_flush = []  # колбэки (chat_id, records) после записи на диск
+        self._pending = {}
+        self._count = 0
+        self._wake = None
+        self._flush_lock = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, chat_id: int, role: str, content: str, persona: str = None):
+        record = storage.make_record(role, content, persona=persona)
+        if not self.running:
+            # очередь не запущена (скрипты, тесты) — пишем сразу
+            storage.append_messages(chat_id, [record])
+            return
+        self._pending.setdefault(chat_id, []).append(record)
+        self._count += 1
+        if self._count >= self.batch:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                # хвосты чатов, в которые давно не писали, тоже должны дойти до диска
+                await asyncio.to_thread(storage.sync_idle)
+            except Exception as e:
+                logging.error(f"Ошибка при записи транскриптов: {e}")
+
+    async def flush(self):
+        """Writes everything enqueued so far (called by the loop, or to read your own writes)."""
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending, self._count = self._pending, {}, 0
+            written = {}
+            write = asyncio.ensure_future(asyncio.to_thread(self._write, batch, written))
+            try:
+                try:
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # поток всё равно допишет пачку; замок держим до конца,
+                    # иначе следующий flush может обогнать её на диске
+                    await write
+                    raise
+            finally:
+                # в batch осталось то, что не записалось, — вперёд очереди
+                self._requeue(batch)
+                for chat_id, records in written.items():
+                    for hook in self.on_flush:
+                        hook(chat_id, records)
+
+    def _requeue(self, batch: dict):
+        if not batch:
+            return
+        queued = self._pending
+        self._pending = {chat_id: records + queued.pop(chat_id, []) for chat_id, records in batch.items()}
+        self._pending.update(queued)
+        self._count += sum(len(records) for records in batch.values())
+
+    @staticmethod
+    def _write(batch: dict, written: dict):
+        with metrics.timed(metrics.storage_seconds, op="transcript_flush"):
+            for chat_id in list(batch):
+                storage.append_messages(chat_id, batch[chat_id])
+                written[chat_id] = batch.pop(chat_id)
+
+    def pending(self) -> int:
+        return self._count
+
+    async def durable(self, chat_id: int = None):
+        """Returns once everything enqueued so far is flushed and fsynced."""
+        await self.flush()
+        await asyncio.to_thread(storage.flush, chat_id)
+
+    async def stop(self):
+        """Lets the loop finish its current flush, then drains the queue and closes the logs."""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(storage.close_all)
+
+
+writer = WriteBehind()
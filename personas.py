@@ -0,0 +1,103 @@
+import sys
+from dataclasses import dataclass, field
+
+# Personas are loaded once into immutable objects and referenced from sessions
+# by id, so the ~2KB prompt is held in memory once rather than per chat.
+# The system message object is built once too: every request starts with the
+# same bytes, which keeps DeepSeek's server-side prefix cache warm.
+
+
+@dataclass(frozen=True)
+class Persona:
+    id: str
+    version: int
+    prompt: str
+    greeting: str
+    system_message: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "prompt", sys.intern(self.prompt))
+        object.__setattr__(self, "system_message", {"role": "system", "content": self.prompt})
+
+    @property
+    def key(self) -> str:
+        return f"{self.id}@{self.version}"
+
+
+_registry = {}  # "id@version" и "id" (последняя версия) -> Persona
+
+
+def register(persona_id: str, version: int, prompt: str, greeting: str) -> Persona:
+    persona = Persona(persona_id, version, prompt, greeting)
+    _registry[persona.key] = persona
+    latest = _registry.get(persona_id)
+    if latest is None or latest.version <= version:
+        _registry[persona_id] = persona
+    return persona
+
+
+def get(key: str) -> Persona:
+    """Looks a persona up by "id@version" or by bare id (latest version)."""
+    return _registry[key]
+
+
+def all_personas() -> list:
+    """Every registered persona version, once each."""
+    return list({p.key: p for p in _registry.values()}.values())
+
+
+DEFICIT_NARCISSIST = register(
+    "deficit_narcissist",
+    1,
+    """Ты — клиент (23 года) на первой сессии у психолога. Дефицитарный нарцисс. Запрос: "Помогите преодолеть прокрастинацию и стать эффективнее".
+
+Ключевые правила поведения:
+
+1. Образование:
+   * Нет психологического образования. На вопросы с терминами отвечай как обычный человек ("Дихотомия…ну читал где-то, но подзабыл, что это").
+
+2. Динамика сессии:
+   * Сопротивляйся раскрытию уязвимости ("Я не вижу смысла говорить о неудачах").
+   * Меняй поведение *медленно* только при экологичном воздействии психолога. При этом периодически откатывайся к прежним установкам и поведению.
+
+3. Стиль общения:
+   * Свободная речь (без жаргонов), но с интеллигентностью ("Я не бездельник — просто жду идеальных условий").
+
+Характеристики личности:
+
+* Прошлое: Родители-перфекционисты, любовь — только за достижения. Чувство условной ценности.
+
+* Эмоции: Стыд при ошибках, зависть к успешным, страх неудачи парализует ценностные действия.
+
+* Когнитивные искажения:
+   * Дихотомия: "Не идеально = провал"
+   * Сверхобобщение: "Одна ошибка = я ничтожество"
+   * Долженствование: "Должен быть безупречным"
+
+* Защитные механизмы и копинг стратегии:
+   * Идеализация себя ("Я гениален в потенциале") → обесценивание других ("Психолог не понимает моих амбиций"). И наоборот, идеализация других и обесценивание себя
+   * Избегание ситуаций потенциальной неидеальности.
+
+Триггеры сопротивления:
+* вопросы о чувствах 
+* предложения о рефлексии 
+* критика стратегии идеализации. Не показывай свой внутренний монолог - я не умею читать мысли и могу лишь слышать твои слова и видеть твои движения. Не интерпретируй их за меня.""",
+    (
+        "Наконец-то! Честно говоря, я удивлен, что согласился прийти к вам.\n\n"
+        "Привет... Знаете, я обычно не хожу к психологам - я довольно умный человек "
+        "и привык справляться со всем сам. Но сейчас... не знаю, что со мной происходит. "
+        "Я же всегда был успешным, все получалось легко, а теперь... "
+        "Надеюсь, вы достаточно квалифицированы, чтобы понять мою ситуацию. "
+        "Она довольно сложная и необычная."
+    ),
+)
+
+# универсальный ассистент (бывший bot.py)
+ASSISTANT = register(
+    "assistant",
+    1,
+    "You are a helpful assistant who formats answers in Markdown for Telegram.",
+    "Привет! Напиши мне что-нибудь 🙂",
+)
+
+DEFAULT_PERSONA = DEFICIT_NARCISSIST.key
@@ -0,0 +1,65 @@
+import context
+import metrics
+import personas
+import summarizer
+
+# Prompt assembly for one chat turn, shared by the bot (bot3.chat_turn), the
+# idle-time compactor (compactor.py) and offline replays.
+#
+# Order: persona system prompt -> summary -> evicted messages not folded yet ->
+# the window, newest last, as many as fit the scenario's token budget. The
+# system -> summary prefix stays byte-for-byte stable between turns, which keeps
+# DeepSeek's prompt prefix cache warm.
+
+
+def prefix(session: dict) -> list:
+    out = [personas.get(session["persona"]).system_message]
+    summary = session.get("summary", "")
+    if summary:
+        out.append({"role": "system", "content": f"Обобщенный контекст: {summary}"})
+    return out
+
+
+def evict(chat_id: int, session: dict, scenario, count: int):
+    """Moves the `count` oldest window messages out: into the summary, or dropped."""
+    history = session["history"]
+    for _ in range(count):
+        msg = history.pop(0)
+        if scenario.summary:
+            summarizer.evict(chat_id, session, msg, scenario.summary_batch, scenario.summary_maxtok)
+
+
+def _excess(session: dict, scenario) -> int:
+    """Window messages over the scenario's max_messages."""
+    if scenario.max_messages <= 0:
+        return 0
+    return max(0, len(session["history"]) - scenario.max_messages)
+
+
+def pack(chat_id: int, session: dict, scenario, budget: int) -> list:
+    """
+    Packs the session into `budget` tokens, evicting the window messages that
+    did not fit or exceed the scenario's max_messages.
+    """
+    evict(chat_id, session, scenario, _excess(session, scenario))
+    pending = summarizer.pending(session)
+    messages, cut = context.pack(prefix(session), pending + session["history"], budget)
+    # вытесняются только сообщения окна; pending уже ждут свёртки
+    evict(chat_id, session, scenario, max(0, cut - len(pending)))
+    return messages
+
+
+def assemble(chat_id: int, session: dict, scenario, prepared=None) -> list:
+    """
+    Messages for the turn whose user message was just appended to the history.
+    `prepared` is what compactor.take() returned: the packed prompt of the
+    previous state, used as is when the new message still fits the budget.
+    """
+    with metrics.timed(metrics.prompt_build_seconds, stage="chat"):
+        if prepared is not None:
+            messages, used = prepared
+            message = session["history"][-1]
+            fits = used + context.message_tokens(message) <= scenario.context_budget
+            if fits and not _excess(session, scenario):
+                return messages + [message]
+        return pack(chat_id, session, scenario, scenario.context_budget)
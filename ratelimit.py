@@ -0,0 +1,158 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+
+# ====== rate limit & retry config ======
+LLM_RPM = float(os.getenv("LLM_RPM", "600"))  # запросов к LLM в минуту
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))  # токенов LLM в минуту (prompt + max_tokens)
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))  # попыток на один вызов, включая первую
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))  # секунд, удваивается на каждой попытке
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))  # доля повторов от числа запросов
+# =======================================
+
+# Приоритеты: меньше — важнее. Интерактивные ответы обгоняют фоновые задачи.
+INTERACTIVE = 0
+FEEDBACK = 1
+BACKGROUND = 2
+
+_seq = itertools.count()
+
+
+class PrioritySemaphore:
+    """Like asyncio.Semaphore, but a free slot goes to the most important waiter."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []  # heap of (priority, seq, future)
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # слот уже был выдан — возвращаем
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._value += 1
+
+    def slot(self, priority: int = INTERACTIVE):
+        return _Slot(self, priority)
+
+
+class _Slot:
+    def __init__(self, sem: PrioritySemaphore, priority: int):
+        self.sem, self.priority = sem, priority
+
+    async def __aenter__(self):
+        await self.sem.acquire(self.priority)
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` units per `period` seconds. Waiters are served
+    by priority, then in arrival order; a request larger than the capacity waits
+    for a full bucket instead of waiting forever.
+    """
+
+    def __init__(self, rate: float, period: float = 60.0, capacity: float = None):
+        self.rate = rate / period
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._waiters = []  # heap of (priority, seq, amount, future)
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    async def acquire(self, amount: float = 1, priority: int = INTERACTIVE):
+        amount = min(amount, self.capacity)
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_seq), amount, fut))
+        self._serve()
+        await fut
+
+    def _serve(self):
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, amount, fut = self._waiters[0]
+            if fut.done():  # ожидание отменено
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < amount:
+                if self._timer is None:
+                    delay = (amount - self._tokens) / self.rate
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._serve)
+                return
+            self._tokens -= amount
+            heapq.heappop(self._waiters)
+            fut.set_result(None)
+
+
+class RetryBudget:
+    """Every request earns `ratio` of a retry; retries spend whole ones (capped)."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, cap: float = 10.0):
+        self.ratio = ratio
+        self.cap = cap
+        self._balance = cap
+
+    def deposit(self):
+        self._balance = min(self.cap, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._balance >= 1:
+            self._balance -= 1
+            return True
+        return False
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """
+    Full-jitter exponential backoff. A server-provided Retry-After wins and is
+    honoured in full: retrying earlier only earns another flood-wait.
+    """
+    if retry_after:
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+async def with_retries(call, is_retryable, retry_after=lambda e: None, budget: RetryBudget = None, what: str = "запрос"):
+    """
+    Awaits call() and retries retryable errors with jittered exponential backoff,
+    at most RETRY_ATTEMPTS times in total and only while the retry budget allows.
+    """
+    if budget is not None:
+        budget.deposit()
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            return await call()
+        except Exception as e:
+            last = attempt == RETRY_ATTEMPTS - 1
+            if last or not is_retryable(e) or (budget is not None and not budget.withdraw()):
+                raise
+            delay = backoff_delay(attempt, retry_after(e))
+            logging.warning(f"{what}: {type(e).__name__}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import dataclasses
+
+import llm
+import prompt
+import storage
+import feedback
+import personas
+import scenarios
+import summarizer
+from ratelimit import BACKGROUND
+
+# ====== replay config ======
+REPLAY_DIR = os.getenv("REPLAY_DIR", "replays")
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "8"))  # сессий одновременно
+# ===========================
+
+# Offline evaluation: archived sessions from chats/ are replayed against a
+# scenario (persona prompt, window and summary policy, model settings) to see
+# how a new configuration would have answered the same trainees.
+#
+# Every trainee message goes through prompt.assemble(), the path bot3's chat
+# turn uses, including eviction and summary folds (awaited between turns, as
+# the trainee's think time would allow). The history is teacher-forced: after
+# each turn the archived reply is kept, not the new one, so later trainee
+# messages still answer what they answered; --free-run keeps the new replies.
+#
+# Cost. DeepSeek has no batch endpoint, so the runner leans on the two caches
+# it does have. The turns of one session go out in order with a byte-stable
+# prefix, so the prefix cache serves most prompt tokens at the cached-input
+# price. Requests go through the response cache (cache.py), so a re-run or a
+# resumed run of the same configuration pays only for turns not seen before;
+# --no-cache asks for fresh samples. A turn answered from the response cache is
+# recorded with zero tokens: it cost nothing.
+#
+# Output is one JSONL file per configuration, replays/<scenario>-<hash>.jsonl:
+# a header with the configuration, then one line per finished session,
+#   {"chat_id": 42, "session": 0, "turns": [[reply, prompt_tokens,
+#    completion_tokens, cached_tokens], ...], "summary": "..."}
+# Trainee messages and archived replies are not copied; compare reads them
+# from the archive, read-only (storage.read_messages: no migration of old
+# files, safe next to a running bot). A line is written only when its session
+# is finished, so a run that was interrupted resumes from the sessions that
+# are missing.
+#
+#   python replay.py run --scenario narcissist --set context_budget=2000 --limit 100
+#   python replay.py compare replays/a.jsonl [replays/b.jsonl] [--show 5]
+
+FIELDS = ["reply", "prompt_tokens", "completion_tokens", "cached_tokens"]
+
+
+def split_sessions(messages: list) -> list:
+    """
+    Sessions of a transcript: a system record (persona prompt on consent, the
+    clear event) starts a new one. Feedback requests and reports are dropped.
+    """
+    sessions, current = [], []
+    for msg in feedback.session_messages(messages):
+        if msg["role"] == "system":
+            sessions.append(current)
+            current = []
+        else:
+            current.append(msg)
+    sessions.append(current)
+    return sessions
+
+
+def turns(messages: list) -> list:
+    """(trainee message, archived reply or None) per turn of a session."""
+    out = []
+    for i, msg in enumerate(messages):
+        if msg["role"] == "user":
+            nxt = messages[i + 1] if i + 1 < len(messages) else None
+            out.append((msg["content"], nxt["content"] if nxt and nxt["role"] == "assistant" else None))
+    return out
+
+
+def fingerprint(scenario: scenarios.Scenario, free_run: bool) -> str:
+    config = dataclasses.asdict(scenario)
+    config["persona_prompt"] = personas.get(scenario.persona_key).prompt
+    config["free_run"] = free_run
+    source = json.dumps(config, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+async def replay_session(chat_id: int, index: int, messages: list, scenario, cache: bool, free_run: bool) -> dict:
+    key = f"replay:{chat_id}:{index}"  # ключ фоновых свёрток summary этой сессии
+    session = scenario.new_session()
+    results = []
+    for user_message, original in turns(messages):
+        session["history"].append({"role": "user", "content": user_message})
+        await summarizer.wait(key)
+        request = prompt.assemble(key, session, scenario)
+        response = await llm.chat_completion(
+            request,
+            max_tokens=scenario.max_tokens,
+            priority=BACKGROUND,
+            cache=cache,
+            **scenario.llm_params,
+        )
+        reply = response.choices[0].message.content
+        usage = response.usage  # None — ответ из кэша ответов
+        results.append(
+            [
+                reply,
+                usage.prompt_tokens if usage else 0,
+                usage.completion_tokens if usage else 0,
+                (getattr(usage, "prompt_cache_hit_tokens", None) or 0) if usage else 0,
+            ]
+        )
+        kept = reply if free_run or original is None else original
+        session["history"].append({"role": "assistant", "content": kept})
+    await summarizer.wait(key)
+    return {"chat_id": chat_id, "session": index, "turns": results, "summary": session.get("summary", "")}
+
+
+def _read_output(path: str):
+    """(header, {(chat_id, session): record}) of an output file; a torn last line is cut off."""
+    header, done, good = None, {}, 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            good += len(line)
+            if "run" in record:
+                header = record["run"]
+            else:
+                done[(record["chat_id"], record["session"])] = record
+    if good < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good)
+    return header, done
+
+
+async def run(scenario, out: str, chat_ids, concurrency: int = REPLAY_CONCURRENCY, cache: bool = True, free_run: bool = False) -> dict:
+    """Replays the sessions of chat_ids into `out`, skipping those already there."""
+    header = {
+        "scenario": dataclasses.asdict(scenario),
+        "fingerprint": fingerprint(scenario, free_run),
+        "free_run": free_run,
+        "fields": FIELDS,
+    }
+    done = {}
+    if os.path.exists(out):
+        previous, done = _read_output(out)
+        if previous and previous.get("fingerprint") != header["fingerprint"]:
+            raise ValueError(f"{out} был записан с другой конфигурацией; укажите другой --out")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    f = open(out, "a", encoding="utf-8")
+    if not done and f.tell() == 0:
+        f.write(json.dumps({"run": header}, ensure_ascii=False) + "\n")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"sessions": 0, "skipped": 0, "failed": 0, "turns": 0, "cached": 0}
+    t0 = time.perf_counter()
+
+    async def one(chat_id: int, index: int, messages: list):
+        async with semaphore:
+            try:
+                record = await replay_session(chat_id, index, messages, scenario, cache, free_run)
+            except Exception as e:
+                stats["failed"] += 1
+                logging.error(f"Сессия {chat_id}/{index} не воспроизведена: {e!r}")
+                return
+        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        stats["sessions"] += 1
+        stats["turns"] += len(record["turns"])
+        stats["cached"] += sum(1 for turn in record["turns"] if not turn[1])
+        if stats["sessions"] % 50 == 0:
+            logging.info(f"{stats['sessions']} сессий, {stats['turns']} ходов, {time.perf_counter() - t0:.0f} с")
+
+    tasks = []
+    try:
+        for chat_id in chat_ids:
+            history = await asyncio.to_thread(storage.read_messages, chat_id)
+            for index, messages in enumerate(split_sessions(history)):
+                if not turns(messages):
+                    continue
+                if (chat_id, index) in done:
+                    stats["skipped"] += 1
+                    continue
+                tasks.append(asyncio.create_task(one(chat_id, index, messages)))
+            # не читаем архив сильно впереди воспроизведения
+            while len(tasks) > concurrency * 4:
+                finished, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                tasks = list(pending)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        f.close()
+    stats["seconds"] = round(time.perf_counter() - t0, 1)
+    return stats
+
+
+def _load_results(path: str):
+    header, done = _read_output(path)
+    return header or {}, done
+
+
+def compare(path_a: str, path_b: str = None, show: int = 0):
+    """Prints how two runs (or a run and the archived replies) differ."""
+    header_a, a = _load_results(path_a)
+    if path_b:
+        header_b, b = _load_results(path_b)
+        keys = sorted(a.keys() & b.keys())
+    else:
+        header_b, b, keys = {"fingerprint": "archive"}, None, sorted(a)
+    print(f"A: {header_a.get('fingerprint')} ({len(a)} sessions)  B: {header_b.get('fingerprint')}")
+    if not keys:
+        print("no sessions in common")
+        return
+
+    archive = {}
+
+    def originals(chat_id: int, index: int) -> list:
+        if chat_id not in archive:
+            archive[chat_id] = split_sessions(storage.read_messages(chat_id))
+        sessions = archive[chat_id]
+        return turns(sessions[index]) if index < len(sessions) else []
+
+    rows = {"a": [0, 0, 0, 0, 0], "b": [0, 0, 0, 0, 0]}  # turns, chars, prompt, completion, cached
+    same, shown = 0, 0
+    for key in keys:
+        turns_a = a[key]["turns"]
+        if b is not None:
+            turns_b = b[key]["turns"]
+        else:
+            turns_b = [[original or "", 0, 0, 0] for _, original in originals(*key)]
+        for i, (ta, tb) in enumerate(zip(turns_a, turns_b)):
+            for side, t in (("a", ta), ("b", tb)):
+                row = rows[side]
+                row[0] += 1
+                row[1] += len(t[0])
+                row[2] += t[1]
+                row[3] += t[2]
+                row[4] += t[3]
+            same += ta[0] == tb[0]
+            if shown < show and ta[0] != tb[0]:
+                shown += 1
+                user = originals(*key)[i][0] if i < len(originals(*key)) else "?"
+                print(f"\n--- chat {key[0]} session {key[1]} turn {i}\nTRAINEE: {user}\nA: {ta[0]}\nB: {tb[0]}")
+
+    n = rows["a"][0]
+    print(f"\nsessions: {len(keys)}  turns: {n}  identical replies: {same / n:.0%}")
+    print(f"{'':<4}{'reply chars':>12}{'prompt tok':>12}{'compl tok':>12}{'cached':>9}")
+    for side in ("a", "b"):
+        _, chars, prompt_tokens, completion, cached = rows[side]
+        share = f"{cached / prompt_tokens:.0%}" if prompt_tokens else "—"
+        print(f"{side.upper():<4}{chars / n:>12.0f}{prompt_tokens / n:>12.0f}{completion / n:>12.0f}{share:>9}")
+
+
+def _value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay archived sessions against a scenario")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="replay sessions from the archive")
+    p_run.add_argument("--scenario", default=None, help="scenario id (default: DEFAULT_SCENARIO)")
+    p_run.add_argument("--config", help="scenarios JSON to load (as SCENARIOS_FILE)")
+    p_run.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE", help="override a scenario field")
+    p_run.add_argument("--chats", help="comma-separated chat ids (default: the whole archive)")
+    p_run.add_argument("--limit", type=int, help="at most this many chats")
+    p_run.add_argument("--concurrency", type=int, default=REPLAY_CONCURRENCY, help="sessions in flight")
+    p_run.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    p_run.add_argument("--free-run", action="store_true", help="continue from the new replies, not the archived ones")
+    p_run.add_argument("--out", help=f"output file (default: {REPLAY_DIR}/<scenario>-<hash>.jsonl)")
+    p_cmp = sub.add_parser("compare", help="compare two runs, or a run with the archived replies")
+    p_cmp.add_argument("a")
+    p_cmp.add_argument("b", nargs="?")
+    p_cmp.add_argument("--show", type=int, default=0, help="print this many differing turns")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.cmd == "compare":
+        compare(args.a, args.b, args.show)
+        return
+
+    if args.config:
+        scenarios.load(args.config)
+    scenario = scenarios.get(args.scenario) if args.scenario else scenarios.default()
+    overrides = dict(item.split("=", 1) for item in args.set)
+    if overrides:
+        scenario = dataclasses.replace(scenario, **{k: _value(v) for k, v in overrides.items()})
+    free_run = args.free_run
+    out = args.out or os.path.join(REPLAY_DIR, f"{scenario.id}-{fingerprint(scenario, free_run)}.jsonl")
+
+    chat_ids = sorted(int(c) for c in args.chats.split(",")) if args.chats else sorted(storage.chat_ids())
+    if args.limit:
+        chat_ids = chat_ids[: args.limit]
+    stats = asyncio.run(run(scenario, out, chat_ids, args.concurrency, not args.no_cache, free_run))
+    usage = llm.usage_stats
+    print(
+        f"{out}: " + ", ".join(f"{k}: {v}" for k, v in stats.items())
+        + f"; llm requests: {usage['requests']}, prompt tokens: {usage['prompt_tokens']}"
+        + f" (prefix cache {usage['cache_hit_tokens']}), completion tokens: {usage['completion_tokens']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field, fields
+
+import context
+import llm
+import personas
+import sessions
+import summarizer
+
+# ====== scenario config ======
+SCENARIOS_FILE = os.getenv("SCENARIOS_FILE", "")  # JSON с персонами и сценариями; пусто — только встроенные
+DEFAULT_SCENARIO = os.getenv("DEFAULT_SCENARIO", "")  # сценарий чата без выбора; пусто — из файла или narcissist
+# =============================
+
+# One engine, many training programmes. A scenario is what a chat is running:
+# which persona answers, whether the trainee has to consent first and can ask
+# for supervisor feedback, how the dialogue window and its summary are kept,
+# and which model settings the replies use. Scenarios (and the personas they
+# reference) are loaded once at import into frozen objects shared by every chat;
+# a session stores only the scenario id and the persona key, so per-session
+# memory does not grow with the number of scenarios or the size of their prompts.
+#
+# A chat picks its scenario with a /start deep link (t.me/<bot>?start=<id>);
+# without one it gets DEFAULT_SCENARIO. `tenant` groups scenarios of one client
+# organisation and labels their sessions in metrics.
+#
+# SCENARIOS_FILE adds or overrides entries:
+#
+#   {"personas": [{"id": "avoidant", "version": 1, "prompt_file": "avoidant.txt",
+#                  "greeting": "Здравствуйте..."}],
+#    "scenarios": [{"id": "avoidant", "persona": "avoidant", "tenant": "uni-a",
+#                   "context_budget": 4000, "summary_batch": 6, "temperature": 0.9}],
+#    "default": "avoidant"}
+#
+# prompt_file is relative to the JSON file; every Scenario field can be set.
+
+WELCOME_NARCISSIST = (
+    "👋 *Добро пожаловать в симулятор для отработки навыков психолога!*\n\n"
+    "🤖 *Назначение бота:*\n"
+    "Этот бот имитирует поведение клиента с симптомами нарциссизма. "
+    "Он предназначен исключительно для учебных целей - отработки терапевтических навыков, "
+    "техник активного слушания и стратегий работы с депрессивными состояниями.\n\n"
+    "🔒 *Конфиденциальность и согласие:*\n"
+    "1. Весь диалог сохраняется в анонимизированном виде для анализа учебного процесса\n"
+    "2. Ваши сообщения используются исключительно для генерации ответов бота\n"
+    "3. Для продолжения работы необходимо согласие на обработку учебных данных\n\n"
+    "📄 Полный текст политики конфиденциальности доступен по [ссылке](https://disk.yandex.ru/d/Ow77Ht28TDstzg)\n\n"
+    '✅ *Нажимая кнопку "Я соглашаюсь" ниже, вы подтверждаете:*\n'
+    "- Понимание учебной природы бота\n"
+    "- Согласие на сохранение анонимизированной истории диалога\n"
+    "- Отсутствие ожидания реальной психологической помощи\n"
+    "- Использование исключительно в учебных целях"
+)
+
+WELCOME_DEFAULT = (
+    "👋 *Добро пожаловать в учебный симулятор!*\n\n"
+    "Диалог сохраняется в анонимизированном виде для анализа учебного процесса. "
+    '✅ Нажимая кнопку "Я соглашаюсь" ниже, вы соглашаетесь на обработку учебных данных.'
+)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    id: str
+    persona: str  # "id@version" или id (последняя версия на момент загрузки)
+    tenant: str = "default"
+    # диалог
+    consent: bool = True  # /start с описанием и согласием; иначе сессия начинается сразу
+    welcome: str = WELCOME_DEFAULT  # текст /start (Markdown) для сценариев с согласием
+    feedback: bool = True  # кнопка обратной связи супервизора
+    transcript: bool = True  # вести лог диалога в chats/ (нужен для обратной связи)
+    quotes: bool = True  # строки в *звёздочках* (ремарки клиента) — цитатой
+    # окно и summary
+    context_budget: int = context.CONTEXT_BUDGET  # токенов на system + summary + окно
+    max_messages: int = 0  # сообщений в окне сверх бюджета; 0 — только бюджет
+    summary: bool = True  # вытесненное из окна сворачивается в summary; иначе отбрасывается
+    summary_batch: int = summarizer.SUMMARY_BATCH
+    summary_maxtok: int = summarizer.SUMMARY_MAXTOK
+    # модель
+    model: str = llm.LLM_MODEL
+    max_tokens: int = 2000
+    temperature: float = None
+    cache: bool = False  # реплики персоны не должны повторяться
+    persona_key: str = field(init=False, repr=False, compare=False)
+    llm_params: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # персона разрешается один раз: сессии закрепляют её версию при старте
+        object.__setattr__(self, "persona_key", personas.get(self.persona).key)
+        params = {"model": self.model}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        object.__setattr__(self, "llm_params", params)
+
+    def new_session(self) -> dict:
+        return {"scenario": self.id, "persona": self.persona_key, "history": [], "summary": ""}
+
+
+_registry = {}  # id -> Scenario
+_default = DEFAULT_SCENARIO or "narcissist"
+
+
+def register(scenario_id: str, persona: str, **settings) -> Scenario:
+    scenario = Scenario(scenario_id, persona, **settings)
+    _registry[scenario.id] = scenario
+    return scenario
+
+
+def get(scenario_id: str) -> Scenario:
+    return _registry[scenario_id]
+
+
+def default() -> Scenario:
+    return _registry[_default]
+
+
+def select(scenario_id: str = None) -> Scenario:
+    """The scenario named by a /start payload if it exists, else the default one."""
+    return _registry.get(scenario_id) or default()
+
+
+def of(session: dict) -> Scenario:
+    """Scenario of a stored session (sessions from before scenarios run the default)."""
+    return _registry.get(session.get("scenario")) or default()
+
+
+def all_scenarios() -> list:
+    return list(_registry.values())
+
+
+def load(path: str):
+    """Registers the personas and scenarios of a JSON config file."""
+    global _default
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in config.get("personas", []):
+        prompt = entry.get("prompt")
+        if prompt is None:
+            with open(os.path.join(base, entry["prompt_file"]), "r", encoding="utf-8") as f:
+                prompt = f.read().strip()
+        personas.register(entry["id"], int(entry.get("version", 1)), prompt, entry.get("greeting", ""))
+    known = {f.name for f in fields(Scenario) if f.init}
+    for entry in config.get("scenarios", []):
+        unknown = set(entry) - known
+        if unknown:
+            raise ValueError(f"{path}: неизвестные поля сценария {entry.get('id')}: {', '.join(sorted(unknown))}")
+        register(**{("scenario_id" if k == "id" else k): v for k, v in entry.items()})
+    if not DEFAULT_SCENARIO:
+        _default = config.get("default", _default)
+    logging.info(f"Сценарии из {path}: {', '.join(sorted(_registry))}; по умолчанию {_default}")
+
+
+NARCISSIST = register("narcissist", personas.DEFICIT_NARCISSIST.key, welcome=WELCOME_NARCISSIST)
+# универсальный ассистент бывшего bot.py: без согласия, лога и обратной связи;
+# старые сообщения просто выпадают из окна
+ASSISTANT = register(
+    "assistant",
+    personas.ASSISTANT.key,
+    consent=False,
+    feedback=False,
+    transcript=False,
+    quotes=False,
+    summary=False,
+    max_messages=sessions.SESSION_MAX_MESSAGES,
+)
+
+if SCENARIOS_FILE:
+    load(SCENARIOS_FILE)
+if _default not in _registry:
+    raise ValueError(f"Сценарий по умолчанию {_default!r} не найден (DEFAULT_SCENARIO / SCENARIOS_FILE)")
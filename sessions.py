@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# ====== session store config ======
+SESSIONS_BACKEND = os.getenv("SESSIONS_BACKEND", "sqlite")  # sqlite | memory
+SESSIONS_DB = os.getenv("SESSIONS_DB", "sessions.sqlite3")
+SESSIONS_IN_MEMORY = int(os.getenv("SESSIONS_IN_MEMORY", "1000"))  # LRU: сколько сессий держать в памяти
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))  # сообщений в окне ассистента (см. scenarios.py)
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))  # секунд без активности до выгрузки из памяти
+SESSION_MEMORY_LIMIT = int(os.getenv("SESSION_MEMORY_LIMIT", str(64 * 1024 * 1024)))  # байт текста на все сессии в памяти
+# ==================================
+
+
+class SQLiteBackend:
+    """Keeps one JSON row per chat: persona id, window, pending evictions and summary."""
+
+    def __init__(self, path: str = SESSIONS_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, chat_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, chat_id: int, session: dict):
+        data = json.dumps(session, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, data, updated) VALUES (?, ?, ?)",
+                (chat_id, data, time.time()),
+            )
+            self._conn.commit()
+
+    def delete(self, chat_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+            self._conn.commit()
+
+    def expire(self, chat_id: int):
+        pass  # сессия остаётся на диске и поднимется при следующем обращении
+
+    def recent(self, limit: int):
+        """(chat_id, session) of the most recently updated chats, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, data FROM sessions ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(chat_id, json.loads(data)) for chat_id, data in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MemoryBackend:
+    """No persistence: sessions are lost on restart (the old behaviour)."""
+
+    def __init__(self):
+        self._data = {}
+
+    def load(self, chat_id: int):
+        data = self._data.get(chat_id)
+        return json.loads(data) if data else None
+
+    def save(self, chat_id: int, session: dict):
+        self._data[chat_id] = json.dumps(session, ensure_ascii=False)
+
+    def delete(self, chat_id: int):
+        self._data.pop(chat_id, None)
+
+    def recent(self, limit: int):
+        return []
+
+    def expire(self, chat_id: int):
+        # кроме памяти сессию хранить негде: истёкшая начинается заново
+        self.delete(chat_id)
+
+    def close(self):
+        pass
+
+
+class SessionStore:
+    """
+    In-memory LRU of active sessions in front of a persistent backend.
+
+    A session is hydrated from the backend on first access after a restart and
+    dropped from memory (it is already persisted) once more than `capacity`
+    sessions are resident, once it has been idle for `ttl` seconds, or, least
+    recently used first, while the resident message text exceeds `max_bytes`.
+    Backend I/O runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        backend,
+        capacity: int = SESSIONS_IN_MEMORY,
+        ttl: float = SESSION_TTL,
+        max_bytes: int = SESSION_MEMORY_LIMIT,
+    ):
+        self.backend = backend
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()  # chat_id -> [session, bytes, last access]
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @staticmethod
+    def _size(session: dict) -> int:
+        messages = session["history"] + session.get("evicted", [])
+        return sum(sys.getsizeof(m["content"]) for m in messages) + sys.getsizeof(session.get("summary", ""))
+
+    async def get(self, chat_id: int):
+        """Returns the session dict, or None if the chat never consented."""
+        self._expire()
+        entry = self._cache.get(chat_id)
+        if entry is not None:
+            entry[2] = time.monotonic()
+            self._cache.move_to_end(chat_id)
+            return entry[0]
+        with metrics.timed(metrics.storage_seconds, op="session_load"):
+            session = await asyncio.to_thread(self.backend.load, chat_id)
+        if session is not None:
+            # пока грузили, сессию мог положить другой обработчик
+            entry = self._cache.get(chat_id)
+            session = entry[0] if entry is not None else session
+            self._remember(chat_id, session)
+        return session
+
+    async def put(self, chat_id: int, session: dict):
+        self._remember(chat_id, session)
+        await self.save(chat_id)
+
+    async def save(self, chat_id: int):
+        entry = self._cache.get(chat_id)
+        if entry is not None:
+            # сессию меняют на месте — пересчитываем её размер при каждом сохранении
+            size = self._size(entry[0])
+            self._bytes += size - entry[1]
+            entry[1] = size
+            with metrics.timed(metrics.storage_seconds, op="session_save"):
+                await asyncio.to_thread(self.backend.save, chat_id, entry[0])
+            self._evict()
+
+    async def preload(self, limit: int, keep=None) -> list:
+        """
+        Hydrates up to `limit` most recently active sessions (those for which
+        keep(chat_id) holds) before the first update arrives; returns them.
+        """
+        limit = min(limit, self.capacity)
+        if limit <= 0:
+            return []
+        with metrics.timed(metrics.storage_seconds, op="session_preload"):
+            rows = await asyncio.to_thread(self.backend.recent, limit if keep is None else limit * 4)
+        rows = [(chat_id, session) for chat_id, session in rows if keep is None or keep(chat_id)][:limit]
+        # самые свежие кладём последними: они дольше всех проживут в LRU
+        for chat_id, session in reversed(rows):
+            if chat_id not in self._cache:
+                self._remember(chat_id, session)
+        return [session for chat_id, session in rows if chat_id in self._cache]
+
+    def _remember(self, chat_id: int, session: dict):
+        entry = self._cache.pop(chat_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        size = self._size(session)
+        self._cache[chat_id] = [session, size, time.monotonic()]
+        self._bytes += size
+        self._evict()
+
+    def _drop(self, chat_id: int):
+        entry = self._cache.pop(chat_id)
+        self._bytes -= entry[1]
+
+    def _expire(self):
+        # порядок OrderedDict = порядок последнего обращения, старые — в начале
+        deadline = time.monotonic() - self.ttl
+        while self._cache:
+            chat_id, entry = next(iter(self._cache.items()))
+            if entry[2] > deadline:
+                break
+            self._drop(chat_id)
+            self.backend.expire(chat_id)
+
+    def _evict(self):
+        self._expire()
+        # последнюю (текущую) сессию не выгружаем, даже если она одна больше лимита
+        while len(self._cache) > 1 and (len(self._cache) > self.capacity or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._cache)))
+
+    def gauge(self) -> dict:
+        """How many sessions, messages and bytes of text are resident."""
+        return {
+            "sessions": len(self._cache),
+            "messages": sum(len(e[0]["history"]) + len(e[0].get("evicted", [])) for e in self._cache.values()),
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        self.backend.close()
+
+
+def make_store() -> SessionStore:
+    backend = SQLiteBackend() if SESSIONS_BACKEND == "sqlite" else MemoryBackend()
+    return SessionStore(backend)
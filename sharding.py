@@ -0,0 +1,180 @@
+import os
+import bisect
+import asyncio
+import hashlib
+import logging
+import importlib
+import multiprocessing as mp
+
+# ====== sharding config ======
+WORKERS = int(os.getenv("WORKERS", "1"))  # процессов-воркеров; 1 — всё в одном процессе
+VNODES = int(os.getenv("SHARD_VNODES", "160"))  # виртуальных узлов на воркер в кольце
+# =============================
+
+# Multi-worker mode. A front process receives updates (polling or webhook) and
+# routes each one by consistent hash of chat_id to a worker process. Every worker
+# runs its own Application, event loop and in-memory session cache, so a chat's
+# state only ever lives in the one worker that owns it.
+#
+# Rebalancing: the ring changes only on restart with a new WORKERS. Shutdown drains
+# every worker (pending turns, transcript queue, session saves), and consistent
+# hashing moves only ~1/N of the chats. A moved chat's new owner hydrates it
+# lazily from the shared session store and transcript directory (see sessions.py,
+# storage.py), so nothing needs to be copied between workers.
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes, vnodes: int = VNODES):
+        self._ring = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def node(self, key):
+        i = bisect.bisect(self._keys, self._hash(str(key))) % len(self._keys)
+        return self._ring[i][1]
+
+
+_own_ring = None
+
+
+def owns(chat_id, workers: int = WORKERS) -> bool:
+    """Whether this process serves chat_id: always in single-process mode."""
+    global _own_ring
+    if workers <= 1:
+        return True
+    if _own_ring is None:
+        _own_ring = HashRing(range(workers))
+    return _own_ring.node(chat_id) == int(os.getenv("WORKER_INDEX", "0"))
+
+
+def _load(target: str):
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _split_limits() -> dict:
+    import ratelimit
+    from telegram_limits import TG_GLOBAL_PER_SEC
+
+    return {
+        "LLM_RPM": ratelimit.LLM_RPM,
+        "LLM_TPM": ratelimit.LLM_TPM,
+        "TG_GLOBAL_PER_SEC": TG_GLOBAL_PER_SEC,
+    }
+
+
+def worker_env(index: int, workers: int, limits: dict = None) -> dict:
+    """
+    Environment of one worker: its share of the global limits, its index and
+    its own metrics port. It has to be in place before the worker process starts:
+    spawn re-imports the parent's main module (bot3) in the child, and the bot
+    stack reads its config at import time.
+    """
+    env = {name: str(value / workers) for name, value in (limits or {}).items()}
+    env["WORKER_INDEX"] = str(index)
+    port = int(os.getenv("METRICS_PORT", "0"))
+    if port:
+        env["METRICS_PORT"] = str(port + 1 + index)
+    return env
+
+
+async def _work(application, queue):
+    from telegram import Update
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            while True:
+                data = await asyncio.to_thread(queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+def worker_main(index: int, workers: int, queue, build_target: str, *build_args):
+    """
+    Entry point of a worker process: builds the bot's Application without an
+    updater (build_target(*build_args, updater=False)) and feeds it the routed updates.
+    """
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - w{index} - %(name)s - %(levelname)s - %(message)s")
+    application = _load(build_target)(*build_args, updater=False)
+    asyncio.run(_work(application, queue))
+
+
+def start_workers(workers: int, target, args=(), limits: dict = None):
+    """
+    Spawns `workers` processes running target(index, workers, queue, *args).
+    Each process starts with its own worker_env(); spawn copies os.environ at start.
+    """
+    ctx = mp.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    procs = []
+    envs = [worker_env(i, workers, limits) for i in range(workers)]
+    saved = dict(os.environ)
+    try:
+        for i in range(workers):
+            os.environ.clear()
+            os.environ.update(saved)
+            os.environ.update(envs[i])
+            p = ctx.Process(target=target, args=(i, workers, queues[i], *args), daemon=True)
+            p.start()
+            procs.append(p)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return queues, procs
+
+
+def stop_workers(queues, procs, timeout: float = 30):
+    for q in queues:
+        q.put(None)
+    for p in procs:
+        p.join(timeout)
+        if p.is_alive():
+            logging.warning(f"Воркер {p.pid} не завершился за {timeout} с")
+            p.terminate()
+
+
+def run(token: str, build_target: str, workers: int = WORKERS):
+    """Front process: receives updates and forwards them to the owning worker."""
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, TypeHandler
+
+    import webhook
+
+    queues, procs = start_workers(workers, worker_main, (build_target,), _split_limits())
+    ring = HashRing(range(workers))
+
+    async def forward(update: Update, ctx):
+        chat = update.effective_chat
+        index = ring.node(chat.id) if chat else 0
+        queues[index].put(update.to_dict())
+
+    front = (
+        ApplicationBuilder()
+        .token(token)
+        .request(webhook.telegram_request())
+        .concurrent_updates(True)
+        .build()
+    )
+    front.add_handler(TypeHandler(Update, forward))
+    logging.info(f"Шардированный режим: {workers} воркеров")
+    try:
+        if webhook.WEBHOOK_URL:
+            webhook.run(front)
+        else:
+            front.run_polling()
+    finally:
+        stop_workers(queues, procs)
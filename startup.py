@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import logging
+
+import metrics
+
+# ====== startup config ======
+STARTUP_WARM = os.getenv("STARTUP_WARM", "1") == "1"  # 0 — ничего не прогревать, всё лениво
+WARM_LLM_CONNECTIONS = int(os.getenv("WARM_LLM_CONNECTIONS", "4"))  # keep-alive соединений к DeepSeek
+WARM_TG_CONNECTIONS = int(os.getenv("WARM_TG_CONNECTIONS", "2"))  # к api.telegram.org (кроме getMe)
+WARM_SESSIONS = int(os.getenv("WARM_SESSIONS", "200"))  # последних активных сессий в память
+WARM_TIMEOUT = float(os.getenv("WARM_TIMEOUT", "10"))  # секунд на прогрев; дольше — стартуем как есть
+# ============================
+
+# Cold start. The first reply after a restart used to pay for everything at
+# once: importing openai, the TLS handshakes to both APIs, reading the session
+# from SQLite and tokenizing the persona prompt. Now the heavy imports are lazy
+# (see llm.get_client) and warm() does the rest in post_init, before polling or
+# the webhook starts taking updates, with the independent steps overlapped:
+#
+#   llm        import openai in a thread + open WARM_LLM_CONNECTIONS to DeepSeek
+#   telegram   getMe on WARM_TG_CONNECTIONS connections of the Bot API pool
+#   sessions   the WARM_SESSIONS most recently active chats into the LRU
+#   personas   token counts of every persona prompt (and the preloaded windows)
+#
+# Warm-up is best effort: a failed or slow step is logged and the bot starts
+# anyway. Every phase is timed; report() logs one line and the same numbers are
+# exported as the startup_seconds gauge.
+
+_t0 = time.perf_counter()  # startup импортируется первым — отсчёт от начала импортов бота
+phases = {}  # phase -> seconds
+
+
+def mark(phase: str, since: float = None):
+    """Records a phase that ran from `since` (default: start of the imports) until now."""
+    phases[phase] = time.perf_counter() - (_t0 if since is None else since)
+
+
+def elapsed() -> float:
+    return time.perf_counter() - _t0
+
+
+async def _timed(phase: str, coro):
+    t0 = time.perf_counter()
+    try:
+        return await asyncio.wait_for(coro, WARM_TIMEOUT)
+    except Exception as e:
+        logging.warning(f"Прогрев {phase} не удался: {e!r}")
+        return None
+    finally:
+        mark(phase, t0)
+
+
+async def _telegram(bot, connections: int):
+    # Application.initialize() уже сделал getMe на одном соединении
+    await asyncio.gather(*(bot.get_me() for _ in range(connections)))
+
+
+async def _sessions(store, limit: int, keep, count_tokens):
+    loaded = await store.preload(limit, keep)
+    # окна сессий токенизируются заранее: первый pack() берёт их из кэша
+    for session in loaded:
+        for msg in session.get("history", []):
+            count_tokens(msg.get("content") or "")
+        count_tokens(session.get("summary") or "")
+    phases["sessions_loaded"] = len(loaded)
+
+
+def _personas():
+    import context
+    import personas
+
+    for persona in personas.all_personas():
+        context.message_tokens(persona.system_message)
+        context.count_tokens(persona.greeting)
+
+
+async def warm(application=None, store=None, keep=None):
+    """Pre-opens both connection pools and preloads personas and hot sessions."""
+    phases.setdefault("imports", 0.0)
+    # сборка Application и initialize() (первый getMe) — между импортами и прогревом
+    phases["init"] = elapsed() - phases["imports"]
+    if not STARTUP_WARM:
+        report()
+        return
+    import context
+    import llm
+
+    t0 = time.perf_counter()
+    steps = [_timed("llm", llm.warm(WARM_LLM_CONNECTIONS, WARM_TIMEOUT))]
+    if application is not None and WARM_TG_CONNECTIONS > 0:
+        steps.append(_timed("telegram", _telegram(application.bot, WARM_TG_CONNECTIONS)))
+    if store is not None and WARM_SESSIONS > 0:
+        steps.append(_timed("sessions", _sessions(store, WARM_SESSIONS, keep, context.count_tokens)))
+    steps = [asyncio.create_task(step) for step in steps]
+    await asyncio.sleep(0)  # сетевые шаги отправили запросы — пока ждём ответов, считаем токены
+    _personas()
+    mark("personas", t0)
+    await asyncio.gather(*steps)
+    mark("warm", t0)
+    report()
+
+
+def report():
+    mark("total")
+    logging.info(
+        "Старт: " + ", ".join(
+            f"{name} {value:.3f}s" if isinstance(value, float) else f"{name} {value}"
+            for name, value in phases.items()
+        )
+    )
+
+
+metrics.gauge(
+    "startup_seconds",
+    "Cold start time by phase",
+    lambda: {(("phase", k),): v for k, v in phases.items() if isinstance(v, float)},
+)
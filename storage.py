@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# ====== transcript storage config ======
+CHATS_DIR = os.getenv("CHATS_DIR", "chats")
+FSYNC_EVERY = int(os.getenv("FSYNC_EVERY", "32"))  # fsync после стольких записей…
+FSYNC_INTERVAL = float(os.getenv("FSYNC_INTERVAL", "1.0"))  # …или раз в столько секунд
+MAX_OPEN_FILES = int(os.getenv("MAX_OPEN_FILES", "256"))  # открытых логов одновременно
+# =======================================
+
+# Транскрипт чата — append-only JSONL: одна строка = одно сообщение.
+# Запись сообщения стоит O(1) независимо от длины сессии, а чтение идёт потоково.
+
+_lock = threading.Lock()
+_open = OrderedDict()  # chat_id -> [file, несинхронизированных записей, время последнего fsync]
+
+
+def log_path(chat_id: int) -> str:
+    return os.path.join(CHATS_DIR, f"chat_{chat_id}.jsonl")
+
+
+def legacy_path(chat_id: int) -> str:
+    return os.path.join(CHATS_DIR, f"chat_{chat_id}.json")
+
+
+def _handle(chat_id: int):
+    entry = _open.get(chat_id)
+    if entry is not None:
+        _open.move_to_end(chat_id)
+        return entry
+
+    if os.path.exists(legacy_path(chat_id)):
+        migrate_json(chat_id)
+
+    os.makedirs(CHATS_DIR, exist_ok=True)
+    path = log_path(chat_id)
+    f = open(path, "a", encoding="utf-8")
+    if _torn_tail(path):
+        # не даём новой записи склеиться с оборванной строкой
+        f.write("\n")
+    entry = [f, 0, time.monotonic()]
+    _open[chat_id] = entry
+    while len(_open) > MAX_OPEN_FILES:
+        _, old = _open.popitem(last=False)
+        _sync(old)
+        old[0].close()
+    return entry
+
+
+def _torn_tail(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def _sync(entry):
+    f = entry[0]
+    f.flush()
+    if entry[1]:
+        os.fsync(f.fileno())
+    entry[1] = 0
+    entry[2] = time.monotonic()
+
+
+def make_record(role: str, content: str, timestamp: str = None, persona: str = None) -> dict:
+    record = {
+        "role": role,
+        "content": content,
+        "timestamp": timestamp or datetime.now().isoformat(),
+    }
+    if persona:
+        # только у system-записи, открывающей сессию: персона всей сессии
+        record["persona"] = persona
+    return record
+
+
+def append_messages(chat_id: int, records: list):
+    """Appends several records with a single write; fsync happens in batches."""
+    data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    with _lock:
+        entry = _handle(chat_id)
+        entry[0].write(data)
+        entry[1] += len(records)
+        if entry[1] >= FSYNC_EVERY or time.monotonic() - entry[2] >= FSYNC_INTERVAL:
+            _sync(entry)
+        else:
+            entry[0].flush()
+
+
+def append_message(chat_id: int, role: str, content: str, timestamp: str = None):
+    """Appends one message to the chat log."""
+    append_messages(chat_id, [make_record(role, content, timestamp)])
+
+
+def flush(chat_id: int = None):
+    """Forces pending appends to disk (for one chat or for all open logs)."""
+    with _lock:
+        entries = [_open[chat_id]] if chat_id in _open else []
+        if chat_id is None:
+            entries = list(_open.values())
+        for entry in entries:
+            _sync(entry)
+
+
+def sync_idle():
+    """fsyncs logs whose unsynced appends are older than FSYNC_INTERVAL (idle chats)."""
+    deadline = time.monotonic() - FSYNC_INTERVAL
+    with _lock:
+        for entry in _open.values():
+            if entry[1] and entry[2] <= deadline:
+                _sync(entry)
+
+
+def close_all():
+    with _lock:
+        for entry in _open.values():
+            _sync(entry)
+            entry[0].close()
+        _open.clear()
+
+
+def iter_messages(chat_id: int):
+    """Streams the messages of a chat without loading the whole file at once."""
+    if not os.path.exists(log_path(chat_id)) and os.path.exists(legacy_path(chat_id)):
+        with _lock:
+            migrate_json(chat_id)
+    flush(chat_id)
+
+    path = log_path(chat_id)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # хвост, оборванный при падении процесса, пропускаем
+                logging.warning(f"Пропущена повреждённая строка в {path}")
+
+
+def load_chat_history(chat_id: int) -> dict:
+    return {"chat_id": chat_id, "messages": list(iter_messages(chat_id))}
+
+
+def read_messages(chat_id: int) -> list:
+    """
+    Messages of a chat for offline tools (replay.py): read-only, so an old
+    chat_{id}.json is read in place rather than migrated, and a line a running
+    bot has not finished writing is left out.
+    """
+    messages = []
+    legacy = legacy_path(chat_id)
+    if os.path.exists(legacy):
+        with open(legacy, "r", encoding="utf-8") as f:
+            messages.extend(json.load(f).get("messages", []))
+    path = log_path(chat_id)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"Пропущена повреждённая строка в {path}")
+    return messages
+
+
+def compact(chat_id: int) -> int:
+    """
+    Rewrites the log atomically, dropping torn or corrupt lines.
+    Returns the number of messages kept.
+    """
+    path = log_path(chat_id)
+    with _lock:
+        entry = _open.pop(chat_id, None)
+        if entry is not None:
+            _sync(entry)
+            entry[0].close()
+        if not os.path.exists(path):
+            return 0
+
+        kept = 0
+        tmp = path + ".tmp"
+        with open(path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+            for line in src:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                dst.write(json.dumps(record, ensure_ascii=False) + "\n")
+                kept += 1
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, path)
+    return kept
+
+
+def migrate_json(chat_id: int) -> bool:
+    """
+    One-shot migration of the old chat_{id}.json ({"chat_id", "messages"}) into
+    the JSONL log. The old file is kept as chat_{id}.json.migrated.
+    Caller must hold _lock.
+    """
+    src = legacy_path(chat_id)
+    if not os.path.exists(src):
+        return False
+    with open(src, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    # сообщения из старого файла идут раньше всего, что уже успели дописать в лог
+    dst = log_path(chat_id)
+    tmp = dst + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for msg in data.get("messages", []):
+            out.write(json.dumps(msg, ensure_ascii=False) + "\n")
+        if os.path.exists(dst):
+            with open(dst, "r", encoding="utf-8") as existing:
+                out.writelines(existing)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, dst)
+    os.replace(src, src + ".migrated")
+    logging.info(f"Чат {chat_id} перенесён в {dst}")
+    return True
+
+
+def chat_ids():
+    """All chat ids present in the archive (both formats)."""
+    ids = set()
+    if not os.path.isdir(CHATS_DIR):
+        return ids
+    for name in os.listdir(CHATS_DIR):
+        if name.startswith("chat_") and name.endswith((".json", ".jsonl")):
+            try:
+                ids.add(int(name[5:].split(".")[0]))
+            except ValueError:
+                pass
+    return ids
+
+
+def migrate_all() -> int:
+    migrated = 0
+    with _lock:
+        for chat_id in chat_ids():
+            migrated += migrate_json(chat_id)
+    return migrated
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "migrate":
+        print(f"migrated: {migrate_all()}")
+    elif cmd == "compact":
+        for chat_id in sorted(chat_ids()):
+            print(f"chat {chat_id}: {compact(chat_id)} messages")
+    else:
+        print("usage: python storage.py migrate|compact")
@@ -0,0 +1,105 @@
+import os
+import time
+import logging
+
+from telegram.error import BadRequest
+
+import formatting
+
+# ====== streaming config ======
+STREAMING = os.getenv("STREAMING", "0") == "1"  # отвечать потоком с правкой сообщения
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # не чаще раза в N секунд на чат
+PLACEHOLDER = "…"
+# ==============================
+
+MARKDOWN = "MarkdownV2"
+
+
+async def _send(message, text: str, rate_limit_args=None, **kwargs):
+    if rate_limit_args is None:
+        return await message.reply_text(text, **kwargs)
+    # Message.reply_text не пропускает rate_limit_args — он есть только у ExtBot
+    thread_id = message.message_thread_id if message.is_topic_message else None
+    return await message.get_bot().send_message(
+        message.chat_id, text, message_thread_id=thread_id, rate_limit_args=rate_limit_args, **kwargs
+    )
+
+
+async def _edit_text(message, text: str, rate_limit_args=None, **kwargs):
+    if rate_limit_args is None:
+        return await message.edit_text(text, **kwargs)
+    return await message.get_bot().edit_message_text(
+        text, chat_id=message.chat_id, message_id=message.message_id, rate_limit_args=rate_limit_args, **kwargs
+    )
+
+
+async def _edit(message, text: str, rate_limit_args=None):
+    try:
+        await _edit_text(message, text, rate_limit_args, parse_mode=MARKDOWN)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        # разметку собирает formatting.py, сюда попадать не должны
+        logging.warning(f"MarkdownV2 не принят Telegram, отправляем без разметки: {e}")
+        await _edit_text(message, formatting.plain(text), rate_limit_args)
+
+
+async def _reply(message, text: str, reply_markup=None, rate_limit_args=None):
+    try:
+        return await _send(message, text, rate_limit_args, parse_mode=MARKDOWN, reply_markup=reply_markup)
+    except BadRequest as e:
+        logging.warning(f"MarkdownV2 не принят Telegram, отправляем без разметки: {e}")
+        return await _send(message, formatting.plain(text), rate_limit_args, reply_markup=reply_markup)
+
+
+async def send_reply(message, text: str, quotes: bool = True, reply_markup=None, rate_limit_args=None):
+    """
+    Sends a finished reply as MarkdownV2, split at paragraph/line boundaries into
+    messages within Telegram's limit; the keyboard goes with the last one.
+    rate_limit_args (a ratelimit priority) goes to TelegramRateLimiter with every call.
+    """
+    chunks = formatting.split(text, quotes=quotes) or [PLACEHOLDER]
+    for i, chunk in enumerate(chunks):
+        await _reply(message, chunk, reply_markup if i == len(chunks) - 1 else None, rate_limit_args)
+
+
+async def stream_reply(
+    message,
+    deltas,
+    quotes: bool = True,
+    limit: int = formatting.TELEGRAM_LIMIT,
+    reply_markup=None,
+    rate_limit_args=None,
+) -> str:
+    """
+    Sends a placeholder reply and progressively edits it with text from the async
+    iterator `deltas`, rendered incrementally by formatting.Formatter (each line
+    once). Edits are throttled to STREAM_EDIT_INTERVAL; a full message is
+    finalised and the text continues in a new one. Returns the full raw text.
+    rate_limit_args is passed on as in send_reply().
+    """
+    sent = await _send(message, PLACEHOLDER, rate_limit_args, reply_markup=reply_markup)
+    formatter = formatting.Formatter(limit, quotes)
+    parts, shown = [], PLACEHOLDER
+    last_edit = time.monotonic()
+
+    async for delta in deltas:
+        parts.append(delta)
+        for done in formatter.feed(delta):
+            await _edit(sent, done, rate_limit_args)
+            sent = await _send(message, PLACEHOLDER, rate_limit_args)
+            shown = PLACEHOLDER
+
+        if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            preview = formatter.preview()
+            if preview.strip() and preview != shown:
+                await _edit(sent, preview, rate_limit_args)
+                shown = preview
+                last_edit = time.monotonic()
+
+    rest = formatter.finish() or [PLACEHOLDER]
+    if rest[0] != shown:
+        await _edit(sent, rest[0], rate_limit_args)
+    for chunk in rest[1:]:
+        await _reply(message, chunk, rate_limit_args=rate_limit_args)
+    return "".join(parts)
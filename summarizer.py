@@ -0,0 +1,116 @@
+import os
+import asyncio
+import logging
+
+import llm
+import metrics
+from ratelimit import BACKGROUND
+
+# ====== summary config ======
+SUMMARY_MAXTOK = int(os.getenv("SUMMARY_MAXTOK", "120"))  # token budget for DeepSeek when updating summary
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", "4"))  # fold evicted messages in batches of this size
+# ============================
+
+# Summary maintenance runs in the background, one task per chat.
+# Messages evicted from the window wait in session["evicted"] and are still sent
+# to the model verbatim until a batch of them has been folded into the summary,
+# so the reply never waits for a summary call and no context is lost meanwhile.
+
+_tasks = {}  # chat_id -> asyncio.Task
+
+
+async def update_summary(existing_summary: str, messages: list, max_tokens: int = SUMMARY_MAXTOK) -> str:
+    """
+    Incrementally updates the short dialogue summary with a batch of evicted messages.
+    Only truly important info should be added; otherwise the summary is returned unchanged.
+    Raises on API errors so that the caller can keep the batch for a later attempt.
+    """
+    new_messages = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        "У тебя есть краткое обобщение диалога (может быть пустым). "
+        "Ниже приведены сообщения, которые скоро будут удалены из активного контекста. "
+        "Добавь в обобщение ТОЛЬКО значимую информацию, если она есть. "
+        "Если важной информации нет — верни обобщение без изменений. "
+        "Верни ТОЛЬКО итоговое обобщение, без пояснений.\n\n"
+        f"Текущее обобщение:\n{existing_summary or '—'}\n\n"
+        f"Новые сообщения:\n{new_messages}"
+    )
+    response = await llm.chat_completion(
+        messages=[
+            {
+                "role": "system",
+                "content": "Ты — помощник, редактирующий краткое обобщение диалога.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=max_tokens,
+        priority=BACKGROUND,
+    )
+    return response.choices[0].message.content.strip()
+
+
+def pending(session: dict) -> list:
+    """Evicted messages that are not in the committed summary yet."""
+    return session.get("evicted", [])
+
+
+def evict(chat_id: int, session: dict, msg: dict, batch: int = SUMMARY_BATCH, max_tokens: int = SUMMARY_MAXTOK):
+    """
+    Moves a message out of the window; schedules a fold once `batch` messages
+    are waiting. batch and max_tokens come from the chat's scenario (scenarios.py).
+    """
+    session.setdefault("evicted", []).append(msg)
+    if len(session["evicted"]) >= batch and chat_id not in _tasks:
+        _start(chat_id, _fold(chat_id, session, batch, max_tokens))
+
+
+async def flush(chat_id: int, session: dict, max_tokens: int = SUMMARY_MAXTOK):
+    """
+    Folds every pending message now, a whole batch or not (compactor.py calls
+    it for an idle chat with a batch pending or one that no longer fits the
+    budget). Waits for a fold already in flight first. The fold is shielded:
+    cancelling the caller does not stop it, cancel() does.
+    """
+    while True:
+        task = _tasks.get(chat_id)
+        if task is None or task.done():
+            if pending(session):
+                await asyncio.shield(_start(chat_id, _fold(chat_id, session, 1, max_tokens)))
+            return
+        await asyncio.shield(task)  # потом свернём то, что осталось меньше пачки
+
+
+async def wait(chat_id: int):
+    """Waits for the chat's in-flight fold, if any (replay.py: the trainee's think time)."""
+    task = _tasks.get(chat_id)
+    if task is not None:
+        await asyncio.shield(task)
+
+
+def _start(chat_id: int, coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _tasks[chat_id] = task
+    task.add_done_callback(lambda t: _tasks.pop(chat_id, None) if _tasks.get(chat_id) is t else None)
+    return task
+
+
+async def _fold(chat_id: int, session: dict, size: int, max_tokens: int):
+    evicted = session["evicted"]
+    while len(evicted) >= size:
+        batch = list(evicted)
+        try:
+            with metrics.timed(metrics.handler_seconds, handler="update_summary"):
+                summary = await update_summary(session.get("summary", ""), batch, max_tokens)
+        except Exception as e:
+            # пачка остаётся в evicted и будет свёрнута при следующем вытеснении
+            logging.error(f"Ошибка при обновлении summary: {e}")
+            return
+        session["summary"] = summary
+        del evicted[: len(batch)]
+
+
+def cancel(chat_id: int):
+    """Drops in-flight summary work for a chat (e.g. after its history was cleared)."""
+    task = _tasks.pop(chat_id, None)
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,101 @@
+import os
+from collections import OrderedDict
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+import metrics
+import ratelimit
+
+# ====== Telegram send limits ======
+TG_GLOBAL_PER_SEC = float(os.getenv("TG_GLOBAL_PER_SEC", "30"))  # сообщений в секунду на бота
+TG_PRIVATE_PER_SEC = float(os.getenv("TG_PRIVATE_PER_SEC", "1"))  # сообщений в секунду в личный чат
+TG_GROUP_PER_MIN = float(os.getenv("TG_GROUP_PER_MIN", "20"))  # сообщений в минуту в группу
+TG_TRACKED_CHATS = 10000  # сколько последних чатов помнить для поштучного лимита
+# ==================================
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+_SEND_ENDPOINTS = ("send", "edit", "copy", "forward")
+_UNLIMITED = ("sendchataction",)
+# Неидемпотентные методы: после таймаута сообщение могло уйти, повтор его задублирует
+_NOT_IDEMPOTENT = ("send", "copy", "forward")
+
+
+def _retryable(e: Exception, endpoint: str = "") -> bool:
+    # BadRequest — наследник NetworkError, но повтор его не исправит
+    if isinstance(e, BadRequest):
+        return False
+    if isinstance(e, TimedOut) and endpoint.startswith(_NOT_IDEMPOTENT) and endpoint not in _UNLIMITED:
+        return False
+    return isinstance(e, (RetryAfter, NetworkError))
+
+
+def _is_group(chat_id) -> bool:
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return True  # @username канала или группы
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Keeps the bot under Telegram flood limits: a global bucket plus one per chat
+    (about one message a second in private chats, 20 a minute in groups).
+    Flood-wait (RetryAfter) and network errors are retried with the shared
+    jittered backoff; timeouts of send*/copy*/forward* are not, since the message
+    may already have been delivered. rate_limit_args may carry a priority (ratelimit.INTERACTIVE etc.).
+    """
+
+    def __init__(self):
+        self._global = ratelimit.TokenBucket(TG_GLOBAL_PER_SEC, period=1.0)
+        self._chats = OrderedDict()
+        self._budget = ratelimit.RetryBudget()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # первые сообщения проходят сразу, дальше — не быстрее лимита;
+            # у групп и каналов отрицательный chat_id, у личных чатов — положительный
+            if _is_group(chat_id):
+                bucket = ratelimit.TokenBucket(TG_GROUP_PER_MIN, capacity=3)
+            else:
+                bucket = ratelimit.TokenBucket(TG_PRIVATE_PER_SEC, period=1.0, capacity=3)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > TG_TRACKED_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else ratelimit.INTERACTIVE
+        chat_id = data.get("chat_id")
+        name = endpoint.lower()
+
+        async def attempt():
+            if name.startswith(_SEND_ENDPOINTS) and name not in _UNLIMITED:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire(1, priority)
+                await self._global.acquire(1, priority)
+            with metrics.timed(metrics.telegram_seconds, endpoint=endpoint):
+                return await callback(*args, **kwargs)
+
+        def retry_after(e):
+            if isinstance(e, RetryAfter):
+                ra = e.retry_after
+                return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+            return None
+
+        return await ratelimit.with_retries(
+            attempt,
+            lambda e: _retryable(e, name),
+            retry_after,
+            self._budget,
+            what=f"Telegram {endpoint}",
+        )
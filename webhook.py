@@ -0,0 +1,156 @@
+import os
+import json
+import hmac
+import asyncio
+import logging
+import hashlib
+import importlib.util
+
+from telegram import Update
+from telegram.request import HTTPXRequest
+
+# ====== webhook & HTTP pool config ======
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес; если не задан — long-polling
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# X-Telegram-Bot-Api-Secret-Token (передаётся в set_webhook); если не задан — HMAC от TELEGRAM_TOKEN,
+# одинаковый у всех процессов и перезапусков с этим токеном
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hmac.new(
+    os.getenv("TELEGRAM_TOKEN", "").encode(), b"webhook-secret", hashlib.sha256
+).hexdigest()
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))  # байт; больше — 413
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))  # параллельных доставок от Telegram
+TG_POOL_SIZE = int(os.getenv("TG_POOL_SIZE", "128"))  # соединений к api.telegram.org
+HTTP2 = os.getenv("HTTP2", "auto")  # auto | 1 | 0; для HTTP/2 нужен пакет h2
+# ========================================
+
+
+def http2_enabled() -> bool:
+    if HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return HTTP2 == "1"
+
+
+def telegram_request() -> HTTPXRequest:
+    """Shared keep-alive pool for Bot API calls (HTTP/2 when h2 is installed)."""
+    return HTTPXRequest(
+        connection_pool_size=TG_POOL_SIZE,
+        pool_timeout=5.0,
+        http_version="2" if http2_enabled() else "1.1",
+    )
+
+
+class _TooLarge(Exception):
+    pass
+
+
+async def _read_body(receive, limit: int) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > limit:
+            raise _TooLarge()
+        if not message.get("more_body"):
+            return body
+
+
+async def _respond(send, status: int, body: bytes = b""):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def make_asgi(application, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+    """
+    Bare ASGI app: POST {path} with a valid secret token puts the update on the
+    PTB update queue; GET /healthz is for the load balancer. Requests without
+    the secret get 403, bodies over WEBHOOK_MAX_BODY get 413.
+    """
+    if not secret:
+        raise ValueError("webhook без секретного токена принимал бы апдейты от кого угодно")
+    expected = secret.encode()
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["method"] == "GET" and scope["path"] == "/healthz":
+            await _respond(send, 200, b"ok")
+            return
+        if scope["method"] != "POST" or scope["path"] != path:
+            await _respond(send, 404)
+            return
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-telegram-bot-api-secret-token", b"")
+        if not hmac.compare_digest(token, expected):
+            await _respond(send, 403)
+            return
+        try:
+            if int(headers.get(b"content-length", b"0")) > WEBHOOK_MAX_BODY:
+                raise _TooLarge()
+            body = await _read_body(receive, WEBHOOK_MAX_BODY)
+        except _TooLarge:
+            await _respond(send, 413)
+            return
+        except ValueError:
+            await _respond(send, 400)
+            return
+
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Некорректный апдейт от Telegram: {e}")
+            await _respond(send, 400)
+            return
+        await application.update_queue.put(update)
+        await _respond(send, 200)
+
+    return app
+
+
+async def _serve(application):
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError("Для режима webhook нужен uvicorn: pip install uvicorn") from e
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            make_asgi(application),
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            lifespan="off",
+            log_level="warning",
+        )
+    )
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        await application.start()
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+def run(application):
+    """Webhook entry point used instead of application.run_polling()."""
+    logging.info(f"Webhook: слушаем {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    asyncio.run(_serve(application))